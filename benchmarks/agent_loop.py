@@ -0,0 +1,260 @@
+"""
+Load test of the agent loop against the mock OpenAI and Dify servers.
+N simulated sessions run their turns concurrently through the same flow as
+the Chainlit handler (AgentLoop.run_turn with a ConversationContext), and
+turn latency, time to first token and throughput are reported.
+
+    poetry run python -m benchmarks.agent_loop --sessions 20 --turns 3
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any
+
+from benchmarks.mock_servers import MockServer, MockSettings
+from benchmarks.results import (
+    format_metrics,
+    load_result,
+    save_result,
+    summarize,
+)
+from src.agent import AgentLoop, HeadlessUI
+from src.config import (
+    get_agent_settings,
+    get_context_settings,
+    get_settings,
+    get_tool_settings,
+)
+from src.context import ConversationContext, ConversationSummarizer
+from src.core import http_pool, rate_limit
+from src.core.openai_module import ChatOpenAIClient, usage_stats
+from src.core.resilience import resilience_stats
+from src.history import HistoryEntry
+from src.initialization import create_tools
+from src.memory import ExperimentalMemory
+from src.planning import PLANNING_MODES
+from src.session_store import get_session_store
+
+
+class TimingUI(HeadlessUI):
+    """
+    Headless UI that records when the first token of the turn is shown
+    """
+
+    def __init__(self) -> None:
+        self.started_at = time.perf_counter()
+        self.first_token_at: float | None = None
+        self.first_answer_token_at: float | None = None
+
+    async def _timed(
+        self, tokens: AsyncIterator[str], answer: bool
+    ) -> AsyncIterator[str]:
+        async for token in tokens:
+            now = time.perf_counter()
+            if self.first_token_at is None:
+                self.first_token_at = now
+            if answer and self.first_answer_token_at is None:
+                self.first_answer_token_at = now
+            yield token
+
+    async def reasoning(self, tokens: AsyncIterator[str]) -> None:
+        await super().reasoning(self._timed(tokens, answer=False))
+
+    async def answer(self, tokens: AsyncIterator[str]) -> None:
+        await super().answer(self._timed(tokens, answer=True))
+
+    async def tool(
+        self, name: str, inputs: str, run: Callable[[], Awaitable[str]]
+    ) -> str:
+        return await run()
+
+
+async def run_session(
+    agent: AgentLoop,
+    client: ChatOpenAIClient,
+    session_id: int,
+    turns: int,
+    samples: dict[str, list[float]],
+) -> int:
+    """
+    Run the turns of one session, returns the number of failed turns
+    """
+    settings = get_settings()
+    context_settings = get_context_settings()
+    sessions = get_session_store()
+    conversation = ConversationContext(
+        settings["model"],
+        context_settings["max_context_tokens"],
+        context_settings["max_tool_output_tokens"],
+        summarizer=ConversationSummarizer(
+            client, settings, context_settings["max_summary_tokens"]
+        ),
+    )
+    errors = 0
+    for turn in range(turns):
+        history = await sessions.load(str(session_id))
+        history.append(
+            HistoryEntry.user(f"Question {turn} of session {session_id}")
+        )
+        ui = TimingUI()
+        try:
+            with rate_limit.scheduling(session=str(session_id)):
+                await agent.run_turn(history, conversation, ui)
+        except Exception as e:
+            logging.error(f"Session {session_id} turn {turn} failed: {e}")
+            errors += 1
+            continue
+        finally:
+            await sessions.save(str(session_id), history)
+        finished_at = time.perf_counter()
+        samples["turn_latency"].append(finished_at - ui.started_at)
+        samples["ttft"].append(
+            (ui.first_token_at or finished_at) - ui.started_at
+        )
+        samples["answer_ttft"].append(
+            (ui.first_answer_token_at or finished_at) - ui.started_at
+        )
+    return errors
+
+
+async def run_benchmark(
+    base_url: str, sessions: int, turns: int, planning_mode: str | None
+) -> dict[str, Any]:
+    client = ChatOpenAIClient(
+        base_url=f"{base_url}/v1", api_key="mock", max_retries=0
+    )
+    memory = ExperimentalMemory(Path(tempfile.mkdtemp()))
+    tools_instances, tools, available_tools = create_tools(memory)
+    agent_settings = dict(get_agent_settings())
+    if planning_mode:
+        agent_settings["planning_mode"] = planning_mode
+    agent = AgentLoop(
+        client,
+        memory,
+        tools_instances,
+        tools,
+        available_tools,
+        settings=get_settings(),
+        agent_settings=agent_settings,
+        tool_settings=get_tool_settings(),
+    )
+
+    samples: dict[str, list[float]] = {
+        "turn_latency": [],
+        "ttft": [],
+        "answer_ttft": [],
+    }
+    started_at = time.perf_counter()
+    errors = await asyncio.gather(
+        *[
+            run_session(agent, client, session_id, turns, samples)
+            for session_id in range(sessions)
+        ]
+    )
+    duration = time.perf_counter() - started_at
+    await http_pool.aclose()
+    await get_session_store().aclose()
+
+    completed = len(samples["turn_latency"])
+    return {
+        "turns": completed,
+        "errors": sum(errors),
+        "duration": duration,
+        "turns_per_second": completed / duration if duration else 0.0,
+        **{name: summarize(values) for name, values in samples.items()},
+        "usage": dict(usage_stats),
+        "resilience": dict(resilience_stats),
+        "rate_limit": rate_limit.get_rate_limit_stats(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--ttft", type=float, default=0.3)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--dify-latency", type=float, default=0.5)
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Share of 429s"
+    )
+    parser.add_argument(
+        "--drop-rate", type=float, default=0.0, help="Share of cut streams"
+    )
+    parser.add_argument(
+        "--dify-stall-rate",
+        type=float,
+        default=0.0,
+        help="Share of streaming Dify workflows that never finish",
+    )
+    parser.add_argument(
+        "--tool-script",
+        type=Path,
+        help="JSON file with the tool calls of each step of a turn",
+    )
+    parser.add_argument("--planning-mode", choices=PLANNING_MODES)
+    parser.add_argument("--name", default="agent_loop")
+    parser.add_argument("--output", type=Path)
+    parser.add_argument(
+        "--compare", type=Path, help="Result file to compare with"
+    )
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    mock_settings = MockSettings(
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        dify_latency=args.dify_latency,
+        error_rate=args.error_rate,
+        drop_rate=args.drop_rate,
+        dify_stall_rate=args.dify_stall_rate,
+    )
+    if args.tool_script:
+        mock_settings.tool_script = json.loads(args.tool_script.read_text())
+
+    with MockServer(mock_settings) as server:
+        # The Dify tools read their endpoints when they are created
+        for name in ("GOOGLESEARCH", "TELEPHONE"):
+            os.environ[f"DIFY_{name}_API_ENDPOINT"] = (
+                f"{server.base_url}/dify/v1"
+            )
+            os.environ[f"DIFY_{name}_API_KEY"] = "mock"
+        metrics = asyncio.run(
+            run_benchmark(
+                server.base_url, args.sessions, args.turns, args.planning_mode
+            )
+        )
+        metrics["requests"] = {
+            "openai": server.openai.requests,
+            "dify": server.dify.requests,
+            "dify_stops": server.dify.stops,
+        }
+
+    config = {
+        "sessions": args.sessions,
+        "turns": args.turns,
+        "planning_mode": args.planning_mode
+        or get_agent_settings()["planning_mode"],
+        **asdict(mock_settings),
+    }
+    output = save_result(args.name, config, metrics, args.output)
+    baseline = load_result(args.compare)["metrics"] if args.compare else None
+    print(format_metrics(metrics, baseline))
+    print(f"Saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""
+Local stand-ins for the OpenAI chat completions API and Dify workflows, so
+that the agent loop can be benchmarked without real API calls
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+from typing import Any
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from src.prompts import FUSED_PROMPT, REASONING_PROMPT
+
+
+@dataclass
+class MockSettings:
+    # Seconds before the first chunk of a completion
+    ttft: float = 0.3
+    # Streamed completion tokens per second, 0 for no delay
+    tokens_per_second: float = 50.0
+    # Completion tokens of plans and answers
+    completion_tokens: int = 60
+    # Tool calls of each step of a turn, e.g.
+    # [[{"name": "googlesearch", "arguments": {"query": "{user}"}}]].
+    # "{user}" in arguments is replaced with the last user message.
+    tool_script: list[list[dict[str, Any]]] = field(
+        default_factory=lambda: [
+            [{"name": "googlesearch", "arguments": {"query": "{user}"}}]
+        ]
+    )
+    # Seconds until a Dify workflow returns its outputs
+    dify_latency: float = 0.5
+    # Share of streaming Dify workflows whose node never finishes
+    dify_stall_rate: float = 0.0
+    # Share of completions rejected with 429 and Retry-After
+    error_rate: float = 0.0
+    # Share of completion streams that are cut off halfway
+    drop_rate: float = 0.0
+
+
+def _last_user_message(messages: list[dict[str, Any]]) -> str:
+    for message in reversed(messages):
+        if message["role"] == "user":
+            return message["content"]
+    return ""
+
+
+def _tool_steps_done(messages: list[dict[str, Any]]) -> int:
+    """
+    Number of tool call steps since the last user message
+    """
+    steps = 0
+    for message in reversed(messages):
+        if message["role"] == "user":
+            break
+        if message["role"] == "assistant" and message.get("tool_calls"):
+            steps += 1
+    return steps
+
+
+def _sse(payload: dict[str, Any]) -> str:
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def _chunk(
+    completion_id: str,
+    model: str,
+    delta: dict[str, Any],
+    finish_reason: str | None = None,
+) -> dict[str, Any]:
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {"index": 0, "delta": delta, "finish_reason": finish_reason}
+        ],
+    }
+
+
+class MockOpenAI:
+    """
+    Streams chat completions in the OpenAI wire format.
+    Reasoning requests get a plan, answer requests call the tools of
+    `tool_script` step by step and then get an answer.
+    """
+
+    def __init__(self, settings: MockSettings) -> None:
+        self.settings = settings
+        self.requests = 0
+
+    def _tool_calls(
+        self, body: dict[str, Any], messages: list[dict[str, Any]]
+    ) -> list[dict[str, Any]]:
+        if not body.get("tools"):
+            return []
+        instruction = messages[-1]["content"] if messages else ""
+        if instruction == REASONING_PROMPT:
+            return []
+        step = _tool_steps_done(messages)
+        if step >= len(self.settings.tool_script):
+            return []
+        user = _last_user_message(messages)
+        return [
+            {
+                "name": call["name"],
+                "arguments": json.dumps(
+                    {
+                        key: (
+                            value.replace("{user}", user)
+                            if isinstance(value, str)
+                            else value
+                        )
+                        for key, value in call["arguments"].items()
+                    },
+                    ensure_ascii=False,
+                ),
+            }
+            for call in self.settings.tool_script[step]
+        ]
+
+    async def _stream(self, body: dict[str, Any]) -> AsyncIterator[str]:
+        messages = body["messages"]
+        model = body.get("model", "mock")
+        completion_id = f"chatcmpl-mock-{self.requests}"
+        tool_calls = self._tool_calls(body, messages)
+        interval = 0.0
+        if self.settings.tokens_per_second > 0:
+            interval = 1.0 / self.settings.tokens_per_second
+
+        drop_at = -1
+        if random.random() < self.settings.drop_rate:
+            drop_at = max(1, self.settings.completion_tokens // 2)
+
+        await asyncio.sleep(self.settings.ttft)
+        completion_tokens = 0
+        if tool_calls:
+            for index, call in enumerate(tool_calls):
+                delta: dict[str, Any] = {
+                    "tool_calls": [
+                        {
+                            "index": index,
+                            "id": f"call_{self.requests}_{index}",
+                            "type": "function",
+                            "function": {
+                                "name": call["name"],
+                                "arguments": call["arguments"],
+                            },
+                        }
+                    ]
+                }
+                yield _sse(_chunk(completion_id, model, delta))
+                completion_tokens += 10
+            finish_reason = "tool_calls"
+        else:
+            fused = bool(messages) and messages[-1]["content"] == FUSED_PROMPT
+            words = ["token"] * self.settings.completion_tokens
+            if fused:
+                words = ["Thought:", *words[:2], "\nAnswer:", *words[2:]]
+            for i, word in enumerate(words):
+                if i == drop_at:
+                    return  # the connection is closed without finishing
+                if i and interval:
+                    await asyncio.sleep(interval)
+                delta = {"content": word if i == 0 else f" {word}"}
+                yield _sse(_chunk(completion_id, model, delta))
+            completion_tokens += len(words)
+            finish_reason = "stop"
+        yield _sse(_chunk(completion_id, model, {}, finish_reason))
+
+        prompt_tokens = sum(
+            len(message.get("content") or "") // 4 for message in messages
+        )
+        usage = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+        yield _sse(usage)
+        yield "data: [DONE]\n\n"
+
+    async def chat_completions(self, request: Request) -> Response:
+        body = await request.json()
+        self.requests += 1
+        if random.random() < self.settings.error_rate:
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached (mock)"}},
+                status_code=429,
+                headers={"retry-after-ms": "100"},
+            )
+        return StreamingResponse(
+            self._stream(body), media_type="text/event-stream"
+        )
+
+
+class MockDify:
+    """
+    Answers `/workflows/run` after `dify_latency`, in blocking or streaming
+    mode. A streaming workflow has one node that streams its result.
+    """
+
+    def __init__(self, settings: MockSettings) -> None:
+        self.settings = settings
+        self.requests = 0
+        self.stops = 0
+
+    async def _stream(
+        self, task_id: str, outputs: dict[str, str]
+    ) -> AsyncIterator[str]:
+        def event(name: str, data: dict[str, Any]) -> str:
+            return _sse({"event": name, "task_id": task_id, "data": data})
+
+        node = {"node_id": "llm", "node_type": "llm", "title": "Mock LLM"}
+        yield event("workflow_started", {"id": task_id})
+        yield event("node_started", node)
+        if random.random() < self.settings.dify_stall_rate:
+            while True:  # until the client gives up
+                await asyncio.sleep(1.0)
+                yield "event: ping\n\n"
+        await asyncio.sleep(self.settings.dify_latency / 2)
+        yield event("text_chunk", {"text": outputs["result"][:20]})
+        await asyncio.sleep(self.settings.dify_latency / 2)
+        yield event("text_chunk", {"text": outputs["result"][20:]})
+        yield event("node_finished", {**node, "status": "succeeded"})
+        yield event(
+            "workflow_finished", {"status": "succeeded", "outputs": outputs}
+        )
+
+    async def workflows_run(self, request: Request) -> Response:
+        body = await request.json()
+        self.requests += 1
+        text = f"mock result for {json.dumps(body['inputs'])}"
+        outputs = {"result": text, "output": text}
+        if body.get("response_mode") == "streaming":
+            return StreamingResponse(
+                self._stream(f"task_{self.requests}", outputs),
+                media_type="text/event-stream",
+            )
+        await asyncio.sleep(self.settings.dify_latency)
+        return JSONResponse({"data": {"outputs": outputs}})
+
+    async def stop(self, request: Request) -> JSONResponse:
+        self.stops += 1
+        return JSONResponse({"result": "success"})
+
+
+def create_app(
+    settings: MockSettings,
+) -> tuple[Starlette, MockOpenAI, MockDify]:
+    """
+    One app serves both APIs: OpenAI under /v1 and Dify under /dify/v1
+    """
+    openai = MockOpenAI(settings)
+    dify = MockDify(settings)
+    app = Starlette(
+        routes=[
+            Route(
+                "/v1/chat/completions",
+                openai.chat_completions,
+                methods=["POST"],
+            ),
+            Route(
+                "/dify/v1/workflows/run", dify.workflows_run, methods=["POST"]
+            ),
+            Route(
+                "/dify/v1/workflows/tasks/{task_id}/stop",
+                dify.stop,
+                methods=["POST"],
+            ),
+        ]
+    )
+    return app, openai, dify
+
+
+class MockServer:
+    """
+    Runs the mock app with uvicorn in a background thread, so that the
+    server's event loop doesn't compete with the benchmarked one
+    """
+
+    def __init__(
+        self, settings: MockSettings, host: str = "127.0.0.1", port: int = 0
+    ) -> None:
+        self.app, self.openai, self.dify = create_app(settings)
+        config = uvicorn.Config(
+            self.app,
+            host=host,
+            port=port,
+            log_level="warning",
+            backlog=4096,
+        )
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.servers[0].sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "MockServer":
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("Mock server failed to start")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *_exc_info: Any) -> None:
+        self.server.should_exit = True
+        self.thread.join()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Serve the mock OpenAI and Dify APIs"
+    )
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--ttft", type=float, default=0.3)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--dify-latency", type=float, default=0.5)
+    parser.add_argument(
+        "--dify-stall-rate",
+        type=float,
+        default=0.0,
+        help="Share of streaming Dify workflows that never finish",
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Share of 429s"
+    )
+    parser.add_argument(
+        "--drop-rate", type=float, default=0.0, help="Share of cut streams"
+    )
+    args = parser.parse_args()
+    app = create_app(
+        MockSettings(
+            ttft=args.ttft,
+            tokens_per_second=args.tokens_per_second,
+            dify_latency=args.dify_latency,
+            dify_stall_rate=args.dify_stall_rate,
+            error_rate=args.error_rate,
+            drop_rate=args.drop_rate,
+        )
+    )[0]
+    uvicorn.run(app, host="127.0.0.1", port=args.port)
@@ -0,0 +1,111 @@
+"""
+Benchmark results: percentile summaries, saving and comparison.
+Results are JSON files with the benchmark name, its configuration and flat
+metrics, so that runs of different commits can be diffed.
+"""
+
+import json
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+RESULTS_DIR = Path("benchmarks/results")
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Percentile with linear interpolation, `q` is in [0, 100]
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    weight = position - lower
+    return ordered[lower] * (1 - weight) + ordered[upper] * weight
+
+
+def summarize(values: list[float]) -> dict[str, float]:
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "mean": sum(values) / len(values) if values else 0.0,
+        "max": max(values, default=0.0),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def save_result(
+    name: str,
+    config: dict[str, Any],
+    metrics: dict[str, Any],
+    output: Path | None = None,
+) -> Path:
+    """
+    Write the result to `output`, by default
+    benchmarks/results/<name>-<timestamp>.json
+    """
+    if output is None:
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        output = RESULTS_DIR / f"{name}-{timestamp}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    result = {
+        "benchmark": name,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": config,
+        "metrics": metrics,
+    }
+    output.write_text(json.dumps(result, indent=2, ensure_ascii=False) + "\n")
+    return output
+
+
+def _flatten(metrics: dict[str, Any], prefix: str = "") -> dict[str, float]:
+    flat: dict[str, float] = {}
+    for key, value in metrics.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def format_metrics(
+    metrics: dict[str, Any], baseline: dict[str, Any] | None = None
+) -> str:
+    """
+    One line per metric, with the change from `baseline` if given
+    """
+    current = _flatten(metrics)
+    previous = _flatten(baseline or {})
+    lines = []
+    for key, value in current.items():
+        line = f"{key:<32} {value:>12.4f}"
+        if key in previous:
+            before = previous[key]
+            change = (value - before) / before * 100 if before else 0.0
+            line += f"  (baseline {before:.4f}, {change:+.1f}%)"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def load_result(path: Path) -> dict[str, Any]:
+    return json.loads(path.read_text())
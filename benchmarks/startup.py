@@ -0,0 +1,132 @@
+"""
+Cold start benchmark. Each run starts a fresh interpreter that imports the
+Chainlit app module, opens a chat and answers one message against the mock
+OpenAI and Dify servers. The time from process start to each stage is
+reported:
+
+- ready: src.main is imported, i.e. the server can start listening
+- welcome: the welcome message of the first chat can be sent
+- first_token: the first token of the first answer is shown
+
+    poetry run python -m benchmarks.startup --runs 5
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import AsyncIterator
+from pathlib import Path
+
+from benchmarks.mock_servers import MockServer, MockSettings
+from benchmarks.results import (
+    format_metrics,
+    load_result,
+    save_result,
+    summarize,
+)
+
+STAGES = ("ready", "welcome", "first_token")
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+async def _first_message() -> None:
+    """
+    What the Chainlit handlers do for the first chat, in the child process
+    """
+    import src.main as app
+    from src.agent import HeadlessUI
+    from src.context import ConversationContext
+    from src.core.tokens import load_encoding
+    from src.history import HistoryEntry
+
+    print("ready", flush=True)
+
+    agent = app.get_agent()
+    conversation = ConversationContext(
+        model=app.settings["model"],
+        max_tokens=app.context_settings["max_context_tokens"],
+        max_tool_output_tokens=app.context_settings["max_tool_output_tokens"],
+    )
+    _ = agent.available_tools_str
+    print("welcome", flush=True)
+    await asyncio.gather(
+        agent.client.warm_up(), load_encoding(app.settings["model"])
+    )
+
+    class FirstTokenUI(HeadlessUI):
+        async def answer(self, tokens: AsyncIterator[str]) -> None:
+            async for _ in tokens:
+                print("first_token", flush=True)
+                break
+            async for _ in tokens:
+                pass
+
+    history = [HistoryEntry.user("Hello, what can you do?")]
+    await agent.run_turn(history, conversation, FirstTokenUI())
+
+
+def _run_child(env: dict[str, str], workdir: Path) -> dict[str, float]:
+    started_at = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.startup", "--child"],
+        cwd=workdir,
+        env=env,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    timings = {}
+    assert process.stdout is not None
+    for line in process.stdout:
+        stage = line.strip()
+        if stage in STAGES:
+            timings[stage] = time.perf_counter() - started_at
+    if process.wait() != 0 or len(timings) != len(STAGES):
+        raise RuntimeError(f"Startup run failed: {timings=}")
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--name", default="startup")
+    parser.add_argument("--output", type=Path)
+    parser.add_argument(
+        "--compare", type=Path, help="Result file to compare with"
+    )
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        asyncio.run(_first_message())
+        return
+
+    mock_settings = MockSettings(ttft=0.0, tokens_per_second=0, tool_script=[])
+    samples: dict[str, list[float]] = {stage: [] for stage in STAGES}
+    with MockServer(mock_settings) as server:
+        env = {
+            **os.environ,
+            "PYTHONPATH": str(REPO_ROOT),
+            "OPENAI_BASE_URL": f"{server.base_url}/v1",
+            "OPENAI_API_KEY": "mock",
+        }
+        for _ in range(args.runs):
+            # A fresh working directory per run, so that the memory and the
+            # Chainlit files are created from scratch as on a new container
+            with tempfile.TemporaryDirectory() as workdir:
+                timings = _run_child(env, Path(workdir))
+            for stage, value in timings.items():
+                samples[stage].append(value)
+
+    metrics = {stage: summarize(values) for stage, values in samples.items()}
+    output = save_result(args.name, {"runs": args.runs}, metrics, args.output)
+    baseline = load_result(args.compare)["metrics"] if args.compare else None
+    print(format_metrics(metrics, baseline))
+    print(f"Saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
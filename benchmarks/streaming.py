@@ -0,0 +1,176 @@
+"""
+Token streaming benchmark, per-chunk frames against coalesced frames.
+N sessions stream answers from the mock OpenAI server at the same time and
+send them to a local socket the way Chainlit sends `stream_token` events,
+once with one frame per chunk and once through `coalesce`. Frames per
+second, bytes sent, CPU time of the event loop and time to first token
+are reported for both.
+
+    poetry run python -m benchmarks.streaming --sessions 50
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from collections.abc import AsyncIterator
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any
+
+from benchmarks.mock_servers import MockServer, MockSettings
+from benchmarks.results import (
+    format_metrics,
+    load_result,
+    save_result,
+    summarize,
+)
+from src.config import get_settings, get_ui_settings
+from src.core.openai_module import ChatOpenAIClient
+from src.core.streaming import coalesce
+
+
+async def _discard(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+) -> None:
+    while await reader.read(65536):
+        pass
+    writer.close()
+
+
+async def run_session(
+    client: ChatOpenAIClient,
+    port: int,
+    window: float,
+    max_bytes: int,
+    samples: dict[str, list[float]],
+) -> dict[str, int]:
+    """
+    Stream one answer into a socket, returns the frames and bytes sent
+    """
+    _, writer = await asyncio.open_connection("127.0.0.1", port)
+    message_id = str(uuid.uuid4())
+    sent = {"frames": 0, "bytes": 0}
+    started_at = time.perf_counter()
+
+    async def _tokens() -> AsyncIterator[str]:
+        async for content, _ in client.stream_completion(
+            messages=[{"role": "user", "content": "Hello"}],
+            settings=get_settings(),
+        ):
+            if content:
+                yield content
+
+    async for token in coalesce(_tokens(), window, max_bytes):
+        if not sent["frames"]:
+            samples["ttft"].append(time.perf_counter() - started_at)
+        # The payload of a Chainlit "stream_token" event
+        frame = json.dumps(
+            {
+                "id": message_id,
+                "token": token,
+                "isSequence": False,
+                "isInput": False,
+            },
+            ensure_ascii=False,
+        ).encode()
+        writer.write(frame + b"\n")
+        await writer.drain()
+        sent["frames"] += 1
+        sent["bytes"] += len(frame) + 1
+    writer.close()
+    await writer.wait_closed()
+    return sent
+
+
+async def run_mode(
+    base_url: str, sessions: int, window: float, max_bytes: int
+) -> dict[str, Any]:
+    client = ChatOpenAIClient(
+        base_url=f"{base_url}/v1", api_key="mock", max_retries=0
+    )
+    sink = await asyncio.start_server(_discard, "127.0.0.1", 0)
+    port = sink.sockets[0].getsockname()[1]
+    samples: dict[str, list[float]] = {"ttft": []}
+
+    # CPU time of this thread only, the mock server runs in another one
+    cpu_started_at = time.thread_time()
+    started_at = time.perf_counter()
+    sent = await asyncio.gather(
+        *[
+            run_session(client, port, window, max_bytes, samples)
+            for _ in range(sessions)
+        ]
+    )
+    duration = time.perf_counter() - started_at
+    cpu_seconds = time.thread_time() - cpu_started_at
+    sink.close()
+    await sink.wait_closed()
+    await client.client.close()
+
+    frames = sum(s["frames"] for s in sent)
+    return {
+        "frames": frames,
+        "frames_per_second": frames / duration if duration else 0.0,
+        "bytes_sent": sum(s["bytes"] for s in sent),
+        "cpu_seconds": cpu_seconds,
+        "duration": duration,
+        "ttft": summarize(samples["ttft"]),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--ttft", type=float, default=0.3)
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--completion-tokens", type=int, default=300)
+    parser.add_argument(
+        "--window",
+        type=float,
+        default=get_ui_settings()["stream_window"],
+        help="Seconds between coalesced frames",
+    )
+    parser.add_argument(
+        "--max-bytes",
+        type=int,
+        default=get_ui_settings()["stream_max_bytes"],
+        help="Bytes that flush a coalesced frame early",
+    )
+    parser.add_argument("--name", default="streaming")
+    parser.add_argument("--output", type=Path)
+    parser.add_argument(
+        "--compare", type=Path, help="Result file to compare with"
+    )
+    args = parser.parse_args()
+
+    mock_settings = MockSettings(
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        tool_script=[],
+    )
+    metrics = {}
+    with MockServer(mock_settings) as server:
+        for mode, window in (("per_chunk", 0.0), ("coalesced", args.window)):
+            metrics[mode] = asyncio.run(
+                run_mode(
+                    server.base_url, args.sessions, window, args.max_bytes
+                )
+            )
+
+    config = {
+        "sessions": args.sessions,
+        "window": args.window,
+        "max_bytes": args.max_bytes,
+        **asdict(mock_settings),
+    }
+    output = save_result(args.name, config, metrics, args.output)
+    baseline = load_result(args.compare)["metrics"] if args.compare else None
+    print(format_metrics(metrics, baseline))
+    print(f"Saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
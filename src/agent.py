@@ -0,0 +1,561 @@
+import asyncio
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import TYPE_CHECKING, Any
+
+from src import telemetry
+from src.common import (
+    get_fused_messages,
+    get_main_messages,
+    get_reasoning_messages,
+)
+from src.context import ConversationContext
+from src.core.openai_module import ChatOpenAIClient
+from src.core.resilience import (
+    cancellation_stats,
+    count_cancelled,
+    tracking_cancellations,
+)
+from src.core.tokens import count_tokens
+from src.history import TOOL_CALLS, HistoryEntry, ToolCall
+from src.memory import ExperimentalMemory
+from src.planning import PlanAnswerSplitter, is_trivial_message
+from src.prompts import LIMIT_PROMPT
+from src.speculation import SpeculativePrefetcher
+from src.tools import BaseTool
+
+if TYPE_CHECKING:
+    from openai.types.chat.chat_completion_chunk import ChoiceDeltaToolCall
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class AgentUI(ABC):
+    """
+    Presentation of an agent turn, implemented by the chat front end.
+    The agent loop hands over token streams and tool runs in order, and the
+    front end decides how to show them.
+    """
+
+    @abstractmethod
+    async def reasoning(self, tokens: AsyncIterator[str]) -> None:
+        pass
+
+    @abstractmethod
+    async def answer(self, tokens: AsyncIterator[str]) -> None:
+        pass
+
+    @abstractmethod
+    async def tool(
+        self, name: str, inputs: str, run: Callable[[], Awaitable[str]]
+    ) -> str:
+        pass
+
+
+class HeadlessUI(AgentUI):
+    """
+    Runs a turn without any front end, e.g. for benchmarks and batch runs
+    """
+
+    async def reasoning(self, tokens: AsyncIterator[str]) -> None:
+        async for _ in tokens:
+            pass
+
+    async def answer(self, tokens: AsyncIterator[str]) -> None:
+        async for _ in tokens:
+            pass
+
+    async def tool(
+        self, name: str, inputs: str, run: Callable[[], Awaitable[str]]
+    ) -> str:
+        return await run()
+
+
+def _answer_tool_calls(history: list[HistoryEntry], output: str) -> None:
+    """
+    Answer the tool calls left without outputs by an interrupted step, as
+    tool calls must be followed by their outputs in the prompts
+    """
+    if history[-1].kind == TOOL_CALLS:
+        history.extend(
+            HistoryEntry.tool_output(tool_call.id, tool_call.name, output)
+            for tool_call in history[-1].tool_calls
+        )
+
+
+def merge_tool_call_deltas(
+    tool_calls_buffer: list[ToolCall],
+    tool_calls: "list[ChoiceDeltaToolCall]",
+) -> None:
+    """
+    Accumulate streamed tool call deltas into complete tool calls
+    """
+    for tool_call in tool_calls:
+        function = tool_call.function
+        if tool_call.index >= len(tool_calls_buffer):
+            tool_calls_buffer.append(
+                ToolCall(
+                    tool_call.id or "",
+                    (function and function.name) or "",
+                    (function and function.arguments) or "",
+                )
+            )
+            continue
+        buffered = tool_calls_buffer[tool_call.index]
+        if function and function.name:
+            buffered.name = function.name
+        if function and function.arguments:
+            buffered.arguments += function.arguments
+
+
+class TurnState:
+    """
+    Progress of one user turn, checked against the loop limits
+    """
+
+    def __init__(self, planning_mode: str, deadline: float) -> None:
+        self.planning_mode = planning_mode
+        # Event loop time by which the steps must be done
+        self.deadline = deadline
+        self.started_at = time.perf_counter()
+        self.first_token_at: float | None = None
+        self.steps = 0
+        self.tokens = 0
+
+    def first_token(self) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+
+class AgentLoop:
+    """
+    Reasoning, answering and tool calling for one user turn, as a bounded
+    loop. Each step is a (reasoning +) answer completion followed by the tool
+    calls it requested. The loop ends when the model answers without tool
+    calls, or with a final answer without tools once `max_steps`,
+    `turn_timeout` or `max_turn_tokens` is reached.
+    """
+
+    def __init__(
+        self,
+        client: ChatOpenAIClient,
+        memory: ExperimentalMemory,
+        tools_instances: list[BaseTool],
+        tools: list[dict],
+        available_tools: dict[str, dict[str, Any]],
+        settings: dict[str, Any],
+        agent_settings: dict[str, Any],
+        tool_settings: dict[str, Any],
+    ):
+        self.client = client
+        self.memory = memory
+        self.tools = tools
+        self.available_tools = available_tools
+        self.settings = settings
+        self.agent_settings = agent_settings
+        self.tool_settings = tool_settings
+        self.tools_by_name = {
+            instance.name: instance for instance in tools_instances
+        }
+        self.available_tools_str = "\n".join(
+            [
+                f"- {instance.name}: {instance.description}"
+                for instance in tools_instances
+            ]
+        )
+
+    def _planning_mode(self, content: str) -> str:
+        planning_mode = self.agent_settings["planning_mode"]
+        if planning_mode == "auto" and is_trivial_message(
+            content, self.agent_settings["trivial_max_chars"]
+        ):
+            return "skip"
+        return planning_mode
+
+    def _limit_reached(self, state: TurnState) -> str | None:
+        if state.steps >= self.agent_settings["max_steps"]:
+            return "max_steps"
+        if asyncio.get_running_loop().time() >= state.deadline:
+            return "turn_timeout"
+        if state.tokens >= self.agent_settings["max_turn_tokens"]:
+            return "max_turn_tokens"
+        return None
+
+    def _count_tokens(self, messages: list[dict[str, Any]]) -> int:
+        model = self.settings["model"]
+        return sum(
+            count_tokens(m.get("content") or "", model) for m in messages
+        )
+
+    async def run_turn(
+        self,
+        history: list[HistoryEntry],
+        conversation: ConversationContext,
+        ui: AgentUI,
+    ) -> str:
+        """
+        Answer the last user message of `history`.
+        Reasoning, tool calls and the answer are appended to `history`.
+        When the turn is cancelled, the completion streams and tool calls in
+        flight are cancelled with it, and `history` is left consistent.
+
+        Returns:
+            str: The final answer
+        """
+        turn_timeout = self.agent_settings["turn_timeout"]
+        reserve = min(
+            self.agent_settings["final_answer_reserve"], turn_timeout / 2
+        )
+        state = TurnState(
+            self._planning_mode(history[-1].content),
+            asyncio.get_running_loop().time() + turn_timeout - reserve,
+        )
+        answer: str | None = None
+        with (
+            telemetry.span("turn", planning_mode=state.planning_mode),
+            tracking_cancellations() as stopped,
+        ):
+            try:
+                while True:
+                    limit = self._limit_reached(state)
+                    if limit:
+                        logger.info(f"Agent loop limit reached: {limit}")
+                        answer = await self._final_answer(
+                            history, conversation, ui, state
+                        )
+                        break
+                    state.steps += 1
+                    # A single step (completions with retries, tool calls)
+                    # can take longer than the whole turn is allowed to
+                    step_deadline = asyncio.timeout_at(state.deadline)
+                    try:
+                        async with step_deadline:
+                            answer = await self._step(
+                                history, conversation, ui, state
+                            )
+                    except TimeoutError:
+                        if not step_deadline.expired():
+                            raise
+                        logger.info(
+                            "Agent loop limit reached: turn_timeout "
+                            f"in step {state.steps}"
+                        )
+                        # Work stopped by the deadline isn't cancelled by
+                        # the user
+                        stopped.clear()
+                        _answer_tool_calls(history, "Timed out.")
+                        answer = await self._final_answer(
+                            history, conversation, ui, state
+                        )
+                        break
+                    if answer is not None:
+                        break
+            except asyncio.CancelledError:
+                cancellation_stats["turns"] += 1
+                for kind, amount in stopped.items():
+                    cancellation_stats[kind] += amount
+                logger.info(f"Turn cancelled after {state.steps} steps")
+                _answer_tool_calls(history, "Cancelled.")
+                raise
+
+        assert answer is not None  # the loop only ends with an answer
+        now = time.perf_counter()
+        ttft = (state.first_token_at or now) - state.started_at
+        logger.info(
+            f"Turn finished: planning_mode={state.planning_mode}, "
+            f"steps={state.steps}, tokens={state.tokens}, "
+            f"ttft={ttft:.2f}s, duration={now - state.started_at:.2f}s"
+        )
+        return answer
+
+    async def reasoning_step(
+        self,
+        history: list[HistoryEntry],
+        conversation: ConversationContext,
+        ui: AgentUI,
+        state: TurnState,
+        prefetcher: SpeculativePrefetcher | None = None,
+    ) -> str:
+        """
+        Think about a solution. The plan is added to history.
+        """
+        messages = get_reasoning_messages(
+            history, conversation, self.available_tools_str, self.memory
+        )
+        state.tokens += self._count_tokens(messages)
+        thought = ""
+
+        with telemetry.span("reasoning") as span:
+
+            async def _tokens() -> AsyncIterator[str]:
+                nonlocal thought
+                async for content, _ in self.client.stream_completion(
+                    messages=messages,
+                    tools=self.tools,
+                    settings=self.settings,
+                    on_usage=span.usage,
+                ):
+                    if content:
+                        span.first_token()
+                        thought += content
+                        if prefetcher:
+                            prefetcher.feed(content)
+                        yield content
+                if prefetcher:
+                    prefetcher.finish()
+
+            await ui.reasoning(_tokens())
+        state.tokens += count_tokens(thought, self.settings["model"])
+        logger.debug(f"Reasoning output: {thought}")
+        history.append(HistoryEntry.thought(thought))
+        return thought
+
+    async def _step(
+        self,
+        history: list[HistoryEntry],
+        conversation: ConversationContext,
+        ui: AgentUI,
+        state: TurnState,
+    ) -> str | None:
+        """
+        Run one step. Returns the answer, or None if tools were called.
+        """
+        await self.memory.refresh()
+        prefetcher: SpeculativePrefetcher | None = None
+        if self.agent_settings["speculative_prefetch"]:
+            prefetcher = SpeculativePrefetcher(self.tools_by_name)
+        try:
+            return await self._run_step(
+                history, conversation, ui, state, prefetcher
+            )
+        finally:
+            if prefetcher:
+                prefetcher.discard()
+
+    async def _run_step(
+        self,
+        history: list[HistoryEntry],
+        conversation: ConversationContext,
+        ui: AgentUI,
+        state: TurnState,
+        prefetcher: SpeculativePrefetcher | None,
+    ) -> str | None:
+        # 1. Reasoning step, or a plan fused into the response completion
+        splitter: PlanAnswerSplitter | None = None
+        if state.planning_mode == "fused":
+            splitter = PlanAnswerSplitter()
+            messages = get_fused_messages(
+                history, conversation, self.available_tools_str, self.memory
+            )
+        else:
+            thought = ""
+            if state.planning_mode != "skip":
+                thought = await self.reasoning_step(
+                    history, conversation, ui, state, prefetcher
+                )
+            messages = get_main_messages(
+                history,
+                conversation,
+                self.available_tools_str,
+                thought,
+                self.memory,
+            )
+        state.tokens += self._count_tokens(messages)
+
+        # 2. Streaming response with tool calls
+        with telemetry.span("answer") as span:
+            tool_calls_buffer = await self._answer_step(
+                messages, history, ui, state, splitter, prefetcher, span
+            )
+        if tool_calls_buffer is None:
+            return history[-1].content
+
+        logger.debug(f"main tool calling: {tool_calls_buffer=}")
+        history.append(HistoryEntry.calls(tool_calls_buffer))
+
+        # Independent tool calls run concurrently, up to the fan-out limit
+        semaphore = asyncio.Semaphore(self.tool_settings["max_parallel_calls"])
+
+        async def _call_tool_limited(
+            tool_call: ToolCall,
+        ) -> HistoryEntry:
+            async with semaphore:
+                return await self.call_tool(
+                    tool_call.id,
+                    tool_call.name,
+                    tool_call.arguments,
+                    ui,
+                    prefetcher,
+                )
+
+        # gather keeps the order of tool_calls_buffer
+        tool_outputs = await asyncio.gather(
+            *[_call_tool_limited(tc) for tc in tool_calls_buffer]
+        )
+        history.extend(tool_outputs)
+        return None
+
+    async def _answer_step(
+        self,
+        messages: list[dict[str, Any]],
+        history: list[HistoryEntry],
+        ui: AgentUI,
+        state: TurnState,
+        splitter: PlanAnswerSplitter | None,
+        prefetcher: SpeculativePrefetcher | None,
+        span: telemetry.Span | telemetry.NoopSpan,
+    ) -> list[ToolCall] | None:
+        """
+        Stream the answer completion. The answer is added to history, and the
+        requested tool calls are returned instead if there are any.
+        """
+        tool_calls_buffer: list[ToolCall] = []
+        stream = self.client.stream_completion(
+            messages=messages,
+            tools=self.tools,
+            settings=self.settings,
+            on_usage=span.usage,
+        )
+        answer = ""
+        pending_answer = ""
+
+        async def _plan_tokens() -> AsyncIterator[str]:
+            nonlocal pending_answer
+            assert splitter is not None
+            async for content, tool_calls in stream:
+                if tool_calls:
+                    merge_tool_call_deltas(tool_calls_buffer, tool_calls)
+                if content:
+                    plan, pending_answer = splitter.feed(content)
+                    if plan:
+                        if prefetcher:
+                            prefetcher.feed(plan)
+                        yield plan
+                    if splitter.answer_started:
+                        return
+            plan = splitter.flush()
+            if not tool_calls_buffer and not splitter.answer_started:
+                # The model answered without the "Answer:" line, show all
+                # of its output as the answer
+                pending_answer, splitter.plan = splitter.plan, ""
+            elif plan:
+                yield plan
+
+        async def _answer_tokens() -> AsyncIterator[str]:
+            nonlocal answer
+            if pending_answer:
+                state.first_token()
+                span.first_token()
+                answer += pending_answer
+                yield pending_answer
+            async for content, tool_calls in stream:
+                if tool_calls:
+                    merge_tool_call_deltas(tool_calls_buffer, tool_calls)
+                if content and splitter:
+                    _, content = splitter.feed(content)
+                if content:
+                    state.first_token()
+                    span.first_token()
+                    answer += content
+                    yield content
+
+        if splitter:
+            plan_tokens = _plan_tokens()
+            await ui.reasoning(plan_tokens)
+            async for _ in plan_tokens:  # in case the UI stopped early
+                pass
+            if splitter.plan:
+                history.append(HistoryEntry.thought(splitter.plan))
+        await ui.answer(_answer_tokens())
+        state.tokens += count_tokens(answer, self.settings["model"])
+
+        # 3. If there is a tool call, it is executed by the caller
+        if tool_calls_buffer:
+            return tool_calls_buffer
+        # If there is no tool call, add the final response to history
+        logger.debug(f"Response: {answer}")
+        history.append(HistoryEntry.answer(answer))
+        return None
+
+    async def _final_answer(
+        self,
+        history: list[HistoryEntry],
+        conversation: ConversationContext,
+        ui: AgentUI,
+        state: TurnState,
+    ) -> str:
+        """
+        Answer with what has been gathered so far, without further tool calls
+        """
+        await self.memory.refresh()
+        messages = get_main_messages(
+            history, conversation, self.available_tools_str, "", self.memory
+        )
+        messages.append({"role": "system", "content": LIMIT_PROMPT})
+        answer = ""
+
+        with telemetry.span("answer") as span:
+
+            async def _answer_tokens() -> AsyncIterator[str]:
+                nonlocal answer
+                async for content, _ in self.client.stream_completion(
+                    messages=messages,
+                    settings=self.settings,
+                    on_usage=span.usage,
+                ):
+                    if content:
+                        state.first_token()
+                        span.first_token()
+                        answer += content
+                        yield content
+
+            await ui.answer(_answer_tokens())
+        logger.debug(f"Response: {answer}")
+        history.append(HistoryEntry.answer(answer))
+        return answer
+
+    async def call_tool(
+        self,
+        tool_call_id: str,
+        name: str,
+        inputs: str,
+        ui: AgentUI,
+        prefetcher: SpeculativePrefetcher | None = None,
+    ) -> HistoryEntry:
+        logger.info(f"call_tool input: {tool_call_id=}, {name=}, {inputs=}")
+
+        async def _run() -> str:
+            with telemetry.span("tool", tool=name):
+                return await _run_tool()
+
+        async def _run_tool() -> str:
+            try:
+                arguments: dict[str, Any] = json.loads(inputs)
+                tool = self.available_tools[name]
+                kwargs = {arg: arguments.get(arg) for arg in tool["args"]}
+                prefetched = None
+                if prefetcher:
+                    prefetched = prefetcher.take(name, kwargs)
+                if prefetched is not None:
+                    function_response = await prefetched
+                else:
+                    function_response = await tool["run"](**kwargs)
+            except asyncio.CancelledError:
+                count_cancelled("tool_calls")
+                raise
+            except Exception as e:
+                logger.error(f"call_tool error: {e}")
+                return "Failed to execute the tool."
+            logger.debug(
+                f"call_tool output: {name=}, {arguments=}, "
+                f"{function_response=}"
+            )
+            return function_response
+
+        return HistoryEntry.tool_output(
+            tool_call_id, name, await ui.tool(name, inputs, _run)
+        )
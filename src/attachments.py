@@ -0,0 +1,275 @@
+import asyncio
+import codecs
+import csv
+import logging
+import mmap
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from src.config import get_attachment_settings
+from src.retrieval import BM25Index
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Bytes decoded at a time from the mapped file
+_READ_SIZE = 64 * 1024
+
+_TEXT_SUFFIXES = {".txt", ".md", ".json", ".xml", ".html", ".log", ".yaml"}
+_TEXT_MIMES = {"application/json", "application/xml", "application/x-yaml"}
+_CSV_MIMES = {"text/csv", "text/tab-separated-values"}
+
+_current_session: ContextVar[str | None] = ContextVar(
+    "attachment_session", default=None
+)
+
+
+class AttachmentError(Exception):
+    """
+    An attached file can't be read
+    """
+
+
+def _detect_encoding(head: bytes) -> str:
+    """
+    UTF-8, or Shift_JIS (cp932) as exported by Japanese Excel
+    """
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(head)
+    except UnicodeDecodeError:
+        return "cp932"
+    return "utf-8"
+
+
+def read_text(path: Path) -> Iterator[str]:
+    """
+    Decode a text file piece by piece from a memory map, so that only the
+    pages being decoded are resident
+    """
+    with open(path, "rb") as file:
+        if path.stat().st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            encoding = _detect_encoding(mapped[:_READ_SIZE])
+            decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+            for start in range(0, len(mapped), _READ_SIZE):
+                yield decoder.decode(mapped[start : start + _READ_SIZE])
+            yield decoder.decode(b"", final=True)
+
+
+def _lines(pieces: Iterable[str]) -> Iterator[str]:
+    rest = ""
+    for piece in pieces:
+        lines = (rest + piece).splitlines(keepends=True)
+        rest = lines.pop() if lines and not lines[-1].endswith("\n") else ""
+        yield from lines
+    if rest:
+        yield rest
+
+
+def _cut(text: str, size: int) -> int:
+    """
+    End of the chunk starting `text`: the last line break, sentence end or
+    space in the second half of `size` characters, else `size`
+    """
+    for separators in ("\n", "。.", " 、,"):
+        cut = max(text.rfind(s, size // 2, size) for s in separators)
+        if cut > 0:
+            return cut + 1
+    return size
+
+
+def chunk_text(
+    pieces: Iterable[str], size: int, overlap: int
+) -> Iterator[str]:
+    """
+    Split streamed text into chunks of about `size` characters, each
+    starting with the last `overlap` characters of the previous one
+    """
+    overlap = min(overlap, size // 4)
+    buffer = ""
+    fresh = False  # text in the buffer that no chunk has contained yet
+    for piece in pieces:
+        buffer += piece
+        fresh = fresh or bool(piece)
+        while len(buffer) >= size:
+            cut = _cut(buffer, size)
+            yield buffer[:cut]
+            buffer = buffer[cut - overlap :]
+            fresh = len(buffer) > overlap
+    if fresh and buffer.strip():
+        yield buffer
+
+
+def _text_chunks(
+    path: Path, name: str, size: int, overlap: int
+) -> Iterator[tuple[str, str]]:
+    for chunk in chunk_text(read_text(path), size, overlap):
+        yield name, chunk
+
+
+def _csv_chunks(
+    path: Path, name: str, size: int, delimiter: str
+) -> Iterator[tuple[str, str]]:
+    """
+    Groups of rows, each starting with the header so that the columns of
+    a passage are known without the others
+    """
+    rows = csv.reader(_lines(read_text(path)), delimiter=delimiter)
+    header = ", ".join(next(rows, []))
+    lines: list[str] = []
+    length = 0
+    first_row = 1
+    for row_number, row in enumerate(rows, start=1):
+        line = ", ".join(row)
+        lines.append(line)
+        length += len(line) + 1
+        if length >= size:
+            label = f"{name} rows {first_row}-{row_number}"
+            yield label, "\n".join([header, *lines])
+            lines, length, first_row = [], 0, row_number + 1
+    if lines:
+        label = f"{name} rows {first_row}-{first_row + len(lines) - 1}"
+        yield label, "\n".join([header, *lines])
+
+
+def _pdf_chunks(
+    path: Path, name: str, size: int, overlap: int
+) -> Iterator[tuple[str, str]]:
+    """
+    The text of each page, extracted one page at a time
+    """
+    from pypdf import PdfReader
+
+    with open(path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            reader = PdfReader(mapped)  # type: ignore[arg-type]
+            for page_number, page in enumerate(reader.pages, start=1):
+                text = page.extract_text() or ""
+                for chunk in chunk_text([text], size, overlap):
+                    yield f"{name} p.{page_number}", chunk
+
+
+def iter_chunks(
+    path: Path, mime: str, name: str, size: int, overlap: int
+) -> Iterator[tuple[str, str]]:
+    """
+    Parse an attached file into (source, passage) pairs as it is read
+    """
+    suffix = path.suffix.lower() or Path(name).suffix.lower()
+    if mime == "application/pdf" or suffix == ".pdf":
+        return _pdf_chunks(path, name, size, overlap)
+    if mime in _CSV_MIMES or suffix in (".csv", ".tsv"):
+        delimiter = "\t" if "tab" in mime or suffix == ".tsv" else ","
+        return _csv_chunks(path, name, size, delimiter)
+    if (
+        mime.startswith("text/")
+        or mime in _TEXT_MIMES
+        or suffix in _TEXT_SUFFIXES
+    ):
+        return _text_chunks(path, name, size, overlap)
+    raise AttachmentError(f"Unsupported file type: {mime or suffix}")
+
+
+class AttachmentIndex:
+    """
+    Passages of the files attached in one session, indexed with BM25.
+    At most `max_chunks` passages are kept.
+    """
+
+    def __init__(self, max_chunks: int) -> None:
+        self.max_chunks = max_chunks
+        self._lock = threading.Lock()
+        self._index = BM25Index()
+        self._sources: list[str] = []
+
+    def __len__(self) -> int:
+        return len(self._sources)
+
+    def _ingest(self, path: Path, mime: str, name: str) -> str:
+        settings = get_attachment_settings()
+        chunks = iter_chunks(
+            path,
+            mime,
+            name,
+            settings["chunk_chars"],
+            settings["chunk_overlap"],
+        )
+        added = 0
+        for source, text in chunks:
+            with self._lock:
+                if len(self._sources) >= self.max_chunks:
+                    return f"{added} passages indexed, the rest is too long"
+                self._index.add(text)
+                self._sources.append(source)
+            added += 1
+        return f"{added} passages indexed"
+
+    async def ingest(self, path: Path, mime: str, name: str) -> str:
+        """
+        Parse and index a file off the event loop.
+        Returns a short status of the file for the prompt.
+        """
+        try:
+            return await asyncio.to_thread(self._ingest, path, mime, name)
+        except Exception as e:
+            logger.warning(f"AttachmentIndex: can't read {name}: {e}")
+            return f"could not be read ({e})"
+
+    def search(self, query: str, top_k: int) -> list[tuple[str, str]]:
+        """
+        Return up to `top_k` (source, passage) pairs, best first
+        """
+        with self._lock:
+            return [
+                (self._sources[doc_id], self._index.documents[doc_id])
+                for doc_id, _ in self._index.search(query, top_k)
+            ]
+
+
+# Indexes of this worker only: the files are uploaded to the worker that
+# received the message, so chats with attachments need sticky sessions
+_indexes: OrderedDict[str, AttachmentIndex] = OrderedDict()
+
+
+def get_attachment_index(session_id: str) -> AttachmentIndex:
+    """
+    Return the attachment index of the session, created on first use
+    """
+    index = _indexes.get(session_id)
+    if index is None:
+        settings = get_attachment_settings()
+        index = AttachmentIndex(settings["max_chunks"])
+        _indexes[session_id] = index
+        while len(_indexes) > settings["max_sessions"]:
+            _indexes.popitem(last=False)
+    _indexes.move_to_end(session_id)
+    return index
+
+
+@contextmanager
+def attachment_session(session_id: str) -> Iterator[None]:
+    """
+    Make the attachments of the session available to tools run in the block
+    """
+    token = _current_session.set(session_id)
+    try:
+        yield
+    finally:
+        _current_session.reset(token)
+
+
+def current_attachment_index() -> AttachmentIndex | None:
+    """
+    Return the attachment index of the current session, if it has files
+    """
+    session_id = _current_session.get()
+    if session_id is None:
+        return None
+    return _indexes.get(session_id)
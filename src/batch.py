@@ -0,0 +1,284 @@
+"""
+Headless batch runner: runs scripted conversations through the agent
+without Chainlit, e.g. for evaluation and data generation.
+
+Each input line is a conversation, {"id": "...", "messages": ["...", ...]},
+whose user messages are sent one turn at a time. Each finished conversation
+is appended to the output as one line with its turns (the plan of each
+step, tool calls, answer, timings) or its error. Conversations already in the output without
+an error are skipped, so an interrupted run resumes where it stopped.
+
+    poetry run python -m src.batch inputs.jsonl outputs.jsonl --workers 8
+
+Against the mock servers (python -m benchmarks.mock_servers):
+
+    poetry run python -m src.batch inputs.jsonl outputs.jsonl \\
+        --base-url http://127.0.0.1:8001/v1 \\
+        --dify-base-url http://127.0.0.1:8001/dify/v1
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
+from pathlib import Path
+from typing import IO, Any
+
+from src.agent import AgentLoop, HeadlessUI
+from src.config import (
+    get_agent_settings,
+    get_context_settings,
+    get_settings,
+    get_tool_settings,
+)
+from src.context import ConversationContext, ConversationSummarizer
+from src.core import http_pool, rate_limit
+from src.core.tokens import load_encoding
+from src.history import HistoryEntry
+from src.initialization import initialize
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Environment variables of the Dify tool endpoints
+DIFY_TOOLS = ("GOOGLESEARCH", "TELEPHONE")
+
+
+class RecordingUI(HeadlessUI):
+    """
+    Headless UI that records what the Chainlit UI would show in a turn
+    """
+
+    def __init__(self) -> None:
+        self.started_at = time.perf_counter()
+        self.first_token_at: float | None = None
+        # One plan per step of the turn
+        self.thoughts: list[str] = []
+        self.tool_calls: list[dict[str, str]] = []
+
+    async def _timed(self, tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+        async for token in tokens:
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+            yield token
+
+    async def reasoning(self, tokens: AsyncIterator[str]) -> None:
+        thought = ""
+        async for token in self._timed(tokens):
+            thought += token
+        self.thoughts.append(thought)
+
+    async def answer(self, tokens: AsyncIterator[str]) -> None:
+        await super().answer(self._timed(tokens))
+
+    async def tool(
+        self, name: str, inputs: str, run: Callable[[], Awaitable[str]]
+    ) -> str:
+        output = await run()
+        self.tool_calls.append(
+            {"name": name, "arguments": inputs, "output": output}
+        )
+        return output
+
+
+def read_conversations(path: Path) -> Iterator[dict[str, Any]]:
+    """
+    Read the input lazily. Conversations without an id are named after
+    their line number.
+    """
+    with open(path, encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            conversation = json.loads(line)
+            conversation.setdefault("id", str(line_number))
+            if "message" in conversation:
+                conversation.setdefault("messages", [conversation["message"]])
+            yield conversation
+
+
+def read_finished(path: Path) -> set[str]:
+    """
+    Ids of the conversations in the output that finished without an error
+    """
+    finished: set[str] = set()
+    if not path.exists():
+        return finished
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # the last line of an interrupted run
+            if result.get("error") is None:
+                finished.add(result["id"])
+            else:
+                finished.discard(result["id"])
+    return finished
+
+
+def _new_conversation(agent: AgentLoop) -> ConversationContext:
+    settings = get_settings()
+    context_settings = get_context_settings()
+    return ConversationContext(
+        model=settings["model"],
+        max_tokens=context_settings["max_context_tokens"],
+        max_tool_output_tokens=context_settings["max_tool_output_tokens"],
+        summarizer=ConversationSummarizer(
+            agent.client, settings, context_settings["max_summary_tokens"]
+        ),
+    )
+
+
+async def run_conversation(
+    agent: AgentLoop, conversation: dict[str, Any]
+) -> dict[str, Any]:
+    """
+    Send the user messages of the conversation turn by turn
+    """
+    context = _new_conversation(agent)
+    history: list[HistoryEntry] = []
+    turns: list[dict[str, Any]] = []
+    result: dict[str, Any] = {"id": conversation["id"], "turns": turns}
+    try:
+        with rate_limit.scheduling(session=conversation["id"]):
+            for message in conversation["messages"]:
+                history.append(HistoryEntry.user(message))
+                ui = RecordingUI()
+                answer = await agent.run_turn(history, context, ui)
+                finished_at = time.perf_counter()
+                turns.append(
+                    {
+                        "user": message,
+                        "thoughts": ui.thoughts,
+                        "tool_calls": ui.tool_calls,
+                        "answer": answer,
+                        "ttft": (ui.first_token_at or finished_at)
+                        - ui.started_at,
+                        "duration": finished_at - ui.started_at,
+                    }
+                )
+    except Exception as e:
+        logger.error(f"Conversation {conversation['id']} failed: {e}")
+        result["error"] = f"{type(e).__name__}: {e}"
+    else:
+        result["error"] = None
+    finally:
+        context.cancel_summary()
+    return result
+
+
+async def run_batch(
+    agent: AgentLoop,
+    conversations: Iterator[dict[str, Any]],
+    output: IO[str],
+    workers: int,
+) -> dict[str, int]:
+    """
+    Run the conversations with `workers` running at a time, writing each
+    result as soon as it is finished
+    """
+    queue: asyncio.Queue[dict[str, Any] | None] = asyncio.Queue(workers * 2)
+    counts = {"finished": 0, "failed": 0}
+
+    async def _worker() -> None:
+        while (conversation := await queue.get()) is not None:
+            result = await run_conversation(agent, conversation)
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            counts["failed" if result["error"] else "finished"] += 1
+            done = counts["finished"] + counts["failed"]
+            if done % 100 == 0:
+                logger.warning(f"{done} conversations done, {counts=}")
+
+    await load_encoding(get_settings()["model"])
+    tasks = [asyncio.create_task(_worker()) for _ in range(workers)]
+    try:
+        for conversation in conversations:
+            await queue.put(conversation)
+        for _ in tasks:
+            await queue.put(None)
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await http_pool.aclose()
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("input", type=Path, help="Conversations (JSONL)")
+    parser.add_argument("output", type=Path, help="Results (JSONL)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--base-url", help="OpenAI-compatible API, e.g. a mock server"
+    )
+    parser.add_argument("--dify-base-url", help="Dify API for the tools")
+    parser.add_argument(
+        "--memory-backend",
+        choices=("memory", "sqlite"),
+        default="memory",
+        help="Memory saved by the runs: kept in the process (default), or "
+        "in the shared store of memory_settings",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Run every conversation again instead of resuming",
+    )
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    # Read by the OpenAI client and the tools when they are created
+    if args.base_url:
+        os.environ["OPENAI_BASE_URL"] = args.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "mock")
+    if args.dify_base_url:
+        for name in DIFY_TOOLS:
+            os.environ[f"DIFY_{name}_API_ENDPOINT"] = args.dify_base_url
+            os.environ.setdefault(f"DIFY_{name}_API_KEY", "mock")
+
+    client, memory, tools_instances, tools, available_tools = initialize(
+        args.memory_backend
+    )
+    agent = AgentLoop(
+        client,
+        memory,
+        tools_instances,
+        tools,
+        available_tools,
+        settings=get_settings(),
+        agent_settings=get_agent_settings(),
+        tool_settings=get_tool_settings(),
+    )
+
+    finished = set() if args.restart else read_finished(args.output)
+    conversations = (
+        conversation
+        for conversation in read_conversations(args.input)
+        if conversation["id"] not in finished
+    )
+    if finished:
+        print(f"Resuming, {len(finished)} conversations already finished")
+    started_at = time.perf_counter()
+    with open(
+        args.output, "w" if args.restart else "a", encoding="utf-8"
+    ) as output:
+        counts = asyncio.run(
+            run_batch(agent, conversations, output, args.workers)
+        )
+    print(
+        f"{counts['finished']} conversations finished, "
+        f"{counts['failed']} failed in "
+        f"{time.perf_counter() - started_at:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
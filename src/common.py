@@ -1,88 +1,94 @@
 from typing import Any
 
+from src import telemetry
+from src.context import ConversationContext
+from src.history import USER, HistoryEntry
 from src.memory import ExperimentalMemory
-from src.prompts import REASONING_PROMPT, SYSTEM_PROMPT
+from src.prompts import (
+    ANSWER_PROMPT,
+    FUSED_PROMPT,
+    MEMORY_PROMPT,
+    REASONING_PROMPT,
+    SYSTEM_PROMPT,
+)
+
+
+def _last_user_message(history: list[HistoryEntry]) -> str:
+    for h in reversed(history):
+        if h.kind == USER:
+            return h.content
+    return ""
+
+
+def _build_messages(
+    history: list[HistoryEntry],
+    conversation: ConversationContext,
+    available_tools_str: str,
+    experimental_memory: ExperimentalMemory,
+    instruction: str,
+) -> list[dict[str, Any]]:
+    """
+    Stable prefix first (instructions, tools, memory), then the conversation
+    as role-separated messages, then the instruction of this completion
+    """
+    with telemetry.span("prompt_build"):
+        system_prompt = SYSTEM_PROMPT.format(
+            available_tools_str=available_tools_str
+        )
+        with telemetry.span("memory_load"):
+            memory = experimental_memory.search(_last_user_message(history))
+        if memory:
+            system_prompt += MEMORY_PROMPT.format(memory=memory)
+        return [
+            {"role": "system", "content": system_prompt},
+            *conversation.update(history),
+            {"role": "system", "content": instruction},
+        ]
 
 
 def get_main_messages(
-    history: list[dict[str, Any]],
+    history: list[HistoryEntry],
+    conversation: ConversationContext,
     available_tools_str: str,
     thought: str,
     experimental_memory: ExperimentalMemory,
 ) -> list[dict[str, Any]]:
-    query = history[-1]["content"]
-
     # Reasoning's content is also included
-    context = ""
-    for h in history:
-        if h["role"] == "user":
-            context += f"User: {h['content']}\n"
-        elif (
-            h["role"] == "assistant"
-            and h["content"]
-            and not h["content"].startswith("Thought:")
-        ):  # AI Agent's response (Thought is not included)
-            context += f"AI Agent: {h['content']}\n"
-        elif h["role"] == "assistant" and h["content"] is None:
-            tool_info = ""
-            for tool_call in h["tool_calls"]:
-                tool_info += f"Tool: {tool_call.function.name} input: {tool_call.function.arguments}\n"
-            context += tool_info
-        elif h["role"] == "tool" and h["content"]:
-            context += f"Tool: {h['name']} output: {h['content']}\n"
-
-    memory = experimental_memory.load()
-    messages = [
-        {
-            "role": "system",
-            "content": SYSTEM_PROMPT.format(
-                context=context,
-                query=query,
-                available_tools_str=available_tools_str,
-                thought=thought,
-                memory=memory,
-            ),
-        }
-    ]
-    return messages
+    return _build_messages(
+        history,
+        conversation,
+        available_tools_str,
+        experimental_memory,
+        ANSWER_PROMPT.format(thought=thought),
+    )
 
 
 def get_reasoning_messages(
-    history: list[dict[str, Any]],
+    history: list[HistoryEntry],
+    conversation: ConversationContext,
     available_tools_str: str,
     experimental_memory: ExperimentalMemory,
 ) -> list[dict[str, Any]]:
-    query = history[-1]["content"]
+    return _build_messages(
+        history,
+        conversation,
+        available_tools_str,
+        experimental_memory,
+        REASONING_PROMPT,
+    )
 
-    # Unify the history into a single string variable `context`
-    context = ""
-    for h in history:
-        if h["role"] == "user":
-            context += f"User: {h['content']}\n"
-        elif (
-            h["role"] == "assistant"
-            and h["content"]
-            and not h["content"].startswith("Thought:")
-        ):
-            context += f"AI Agent: {h['content']}\n"
-        elif h["role"] == "assistant" and h["content"] is None:  # input
-            tool_info = ""
-            for tool_call in h["tool_calls"]:
-                tool_info += f"Tool: {tool_call.function.name} input: {tool_call.function.arguments}\n"
-            context += tool_info
-        elif h["role"] == "tool" and h["content"]:  # output
-            context += f"Tool: {h['name']} output: {h['content']}\n"
 
-    memory = experimental_memory.load()
-    messages = [
-        {
-            "role": "system",
-            "content": REASONING_PROMPT.format(
-                context=context,
-                query=query,
-                available_tools_str=available_tools_str,
-                memory=memory,
-            ),
-        }
-    ]
-    return messages
+def get_fused_messages(
+    history: list[HistoryEntry],
+    conversation: ConversationContext,
+    available_tools_str: str,
+    experimental_memory: ExperimentalMemory,
+) -> list[dict[str, Any]]:
+    # The plan and the answer are generated by a single completion
+    return _build_messages(
+        history,
+        conversation,
+        available_tools_str,
+        experimental_memory,
+        FUSED_PROMPT,
+    )
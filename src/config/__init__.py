@@ -1,13 +1,91 @@
 import os
+from types import ModuleType
 
 from . import development, production
 
 
-def get_settings():
+def _get_profile() -> ModuleType:
     """
-    Return the correct settings based on the environment
+    Return the settings module based on the environment
     """
     mode = os.getenv("MODE", "development")
     if mode == "production":
-        return production.settings
-    return development.settings
+        return production
+    return development
+
+
+def get_settings():
+    """
+    Return the correct settings based on the environment
+    """
+    return _get_profile().settings
+
+
+def get_tool_settings():
+    """
+    Return the tool runtime settings based on the environment
+    """
+    return _get_profile().tool_settings
+
+
+def get_context_settings():
+    """
+    Return the conversation context settings based on the environment
+    """
+    return _get_profile().context_settings
+
+
+def get_memory_settings():
+    """
+    Return the experimental memory settings based on the environment
+    """
+    return _get_profile().memory_settings
+
+
+def get_attachment_settings():
+    """
+    Return the attached file indexing settings based on the environment
+    """
+    return _get_profile().attachment_settings
+
+
+def get_agent_settings():
+    """
+    Return the agent loop settings based on the environment
+    """
+    return _get_profile().agent_settings
+
+
+def get_resilience_settings():
+    """
+    Return the completion retry and fallback settings based on the environment
+    """
+    return _get_profile().resilience_settings
+
+
+def get_rate_limit_settings():
+    """
+    Return the client-side rate limit settings based on the environment
+    """
+    return _get_profile().rate_limit_settings
+
+
+def get_session_settings():
+    """
+    Return the session storage settings based on the environment
+    """
+    return _get_profile().session_settings
+
+
+def get_ui_settings():
+    """
+    Return the chat UI settings based on the environment
+    """
+    return _get_profile().ui_settings
+
+
+def get_telemetry_settings():
+    """
+    Return the telemetry settings based on the environment
+    """
+    return _get_profile().telemetry_settings
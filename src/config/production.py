@@ -3,3 +3,142 @@ settings = {
     "temperature": 0.2,
     "max_tokens": 500,
 }
+
+tool_settings = {
+    # Upper bound of threads used to run tools without a native async `arun`
+    "max_workers": 8,
+    # Upper bound of tool calls from one model turn executed concurrently
+    "max_parallel_calls": 4,
+    # Shared keep-alive connection pool for Dify workflow endpoints
+    "http_pool_size": 20,
+    "http_max_per_host": 10,
+    "http_keepalive_expiry": 30.0,
+    "http_connect_timeout": 10.0,
+    "http_read_timeout": 30.0,
+    # Dify workflows: "streaming" shows node progress and partial text in
+    # the tool step, "blocking" waits for the whole workflow
+    "dify_response_mode": "streaming",
+    # Seconds a streaming workflow may run in total, and each of its nodes
+    "dify_workflow_timeout": 30.0,
+    "dify_node_timeout": 15.0,
+    # Seconds the stop request of an abandoned workflow may take, it is
+    # sent in the background
+    "dify_stop_timeout": 3.0,
+    # Tool result cache, "memory" for one worker or "disk" to share it
+    "cache_backend": "memory",
+    "cache_path": ".cache/tool_cache.sqlite3",
+    "cache_max_entries": 1024,
+    # TTL in seconds per tool name, tools not listed here are not cached
+    "cache_ttl": {
+        "get_representative_telephone": 24 * 60 * 60,
+        "googlesearch": 10 * 60,
+    },
+}
+
+context_settings = {
+    # Token budget of the conversation part of the prompts
+    "max_context_tokens": 8000,
+    # Tool outputs longer than this are truncated in the prompts
+    "max_tool_output_tokens": 1000,
+    # Length of the rolling summary of turns that no longer fit the budget
+    "max_summary_tokens": 300,
+}
+
+memory_settings = {
+    # "sqlite": a database under memory_dir, shared by the workers using it
+    # "memory": kept in the worker process only, lost on restart
+    "backend": "sqlite",
+    "memory_dir": "src/memories",
+    # Seconds between checks of the memory directory for outside changes
+    "check_interval": 1.0,
+    # Only the most relevant experiences are put into the prompts
+    "top_k": 5,
+    "max_tokens": 500,
+}
+
+attachment_settings = {
+    # Attached files are split into passages of about this many characters,
+    # overlapping so that sentences cut at a boundary are found from both
+    "chunk_chars": 1200,
+    "chunk_overlap": 150,
+    # Passages kept per session, the rest of larger files is not indexed
+    "max_chunks": 2000,
+    # Sessions whose attachments are kept, the least recently used are dropped
+    "max_sessions": 100,
+    # Passages returned by one search, within this many tokens
+    "top_k": 4,
+    "max_tokens": 1500,
+}
+
+agent_settings = {
+    # "always", "fused" or "auto", see src/planning.py
+    "planning_mode": "always",
+    # In "auto" mode, small talk up to this length skips the reasoning call
+    "trivial_max_chars": 30,
+    # Limits of one user turn, a final answer is given once one is reached
+    "max_steps": 5,
+    "turn_timeout": 120.0,
+    "max_turn_tokens": 60000,
+    # Seconds of turn_timeout kept for the final answer: a step still
+    # running past turn_timeout - final_answer_reserve is cut short
+    "final_answer_reserve": 15.0,
+    # Start read-only tools planned in "Action(N):" lines while reasoning
+    "speculative_prefetch": False,
+}
+
+resilience_settings = {
+    # Retries of a failed or dropped completion, with jittered exponential
+    # backoff (seconds) that honors Retry-After
+    "max_retries": 3,
+    "backoff_base": 0.5,
+    "backoff_max": 20.0,
+    # A model is skipped after this many consecutive failures, until the
+    # reset timeout (seconds) has passed
+    "circuit_failure_threshold": 5,
+    "circuit_reset_timeout": 30.0,
+    # Model used for retries once the main model failed, None to disable
+    "fallback_model": "gpt-4o-mini",
+}
+
+rate_limit_settings = {
+    # Client-side budgets, so that bursts queue here instead of hitting the
+    # provider limits. Match them to the organization's usage tier.
+    "enabled": True,
+    # Requests and tokens per minute of each model, "default" for the others
+    "models": {
+        "gpt-4o": {"rpm": 5000, "tpm": 800000},
+        "gpt-4o-mini": {"rpm": 5000, "tpm": 4000000},
+    },
+    # Requests per minute of each Dify endpoint, "default" for the others
+    "dify_endpoints": {"default": {"rpm": 600}},
+}
+
+session_settings = {
+    # "memory": history is kept in the worker that serves the chat
+    # "sqlite": history is stored in `path`, so any worker sharing the file
+    # can serve the next turn of a session
+    "backend": "memory",
+    "path": ".cache/sessions.sqlite3",
+    # In-process sessions kept, the least recently used ones are dropped
+    "max_sessions": 1000,
+    # Saves arriving within this many seconds are committed together
+    "batch_window": 0.01,
+}
+
+ui_settings = {
+    # Streamed tokens are sent to the browser in frames: at most one per
+    # window (seconds), or sooner once this many bytes are pending.
+    # A window of 0 sends every chunk of the completion as it arrives.
+    "stream_window": 0.05,
+    "stream_max_bytes": 512,
+}
+
+telemetry_settings = {
+    # Spans of reasoning, answer, tool calls, memory load and prompt build
+    "enabled": False,
+    # "prometheus" serves /metrics, "file" appends OTLP-shaped JSON lines
+    "exporter": "prometheus",
+    "path": ".cache/spans.jsonl",
+    # Seconds between writes of the buffered spans to the file
+    "flush_interval": 1.0,
+}
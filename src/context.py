@@ -0,0 +1,199 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from src.core import rate_limit
+from src.core.openai_module import ChatOpenAIClient
+from src.core.tokens import count_tokens, truncate_tokens
+from src.history import HistoryEntry
+from src.prompts import SUMMARY_PROMPT
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# (previous summary, conversation lines to fold in) -> new summary
+Summarizer = Callable[[str, str], Awaitable[str]]
+
+
+def message_text(message: dict[str, Any]) -> str:
+    """
+    Render a chat message as a plain text line, e.g. for the summary
+    """
+    if message["role"] == "user":
+        return f"User: {message['content']}\n"
+    elif message["role"] == "assistant" and message["content"]:
+        return f"AI Agent: {message['content']}\n"
+    elif message["role"] == "assistant":
+        return "".join(
+            f"Tool: {tool_call['function']['name']} input: {tool_call['function']['arguments']}\n"
+            for tool_call in message["tool_calls"]
+        )
+    return f"Tool output: {message['content']}\n"
+
+
+class ConversationSummarizer:
+    """
+    Folds old conversation lines into a rolling summary with the LLM
+    """
+
+    def __init__(
+        self,
+        client: ChatOpenAIClient,
+        settings: dict[str, Any],
+        max_tokens: int,
+    ):
+        self.client = client
+        self.settings = settings
+        self.max_tokens = max_tokens
+
+    async def __call__(self, summary: str, lines: str) -> str:
+        messages = [
+            {
+                "role": "system",
+                "content": SUMMARY_PROMPT.format(
+                    summary=summary or "(none)", context=lines
+                ),
+            }
+        ]
+        new_summary = ""
+        # Summaries wait for the answers of all sessions
+        with rate_limit.scheduling(priority=rate_limit.BACKGROUND):
+            async for content, _ in self.client.stream_completion(
+                messages=messages,
+                settings={**self.settings, "max_tokens": self.max_tokens},
+            ):
+                if content:
+                    new_summary += content
+        return new_summary.strip()
+
+
+class ConversationContext:
+    """
+    Per-session rendering of the conversation history as chat messages.
+    History is append-only, so each entry is rendered once when it is first
+    seen and all prompt builders share the result.
+
+    The rendered context is kept under `max_tokens`: the most recent messages
+    are kept verbatim, large tool outputs are truncated, and older messages
+    are folded into a rolling summary that is refreshed in the background.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        max_tokens: int,
+        max_tool_output_tokens: int,
+        summarizer: Summarizer | None = None,
+    ) -> None:
+        self.model = model
+        self.max_tokens = max_tokens
+        self.max_tool_output_tokens = max_tool_output_tokens
+        self.summarizer = summarizer
+        self._messages: list[dict[str, Any]] = []
+        self._message_tokens: list[int] = []
+        self._rendered = 0
+        self._context: list[dict[str, Any]] | None = []
+        # The summary covers self._messages[: self._summarized]
+        self._summary = ""
+        self._summarized = 0
+        self._summary_task: asyncio.Task[None] | None = None
+
+    def _truncate_output(self, content: str) -> str:
+        truncated = truncate_tokens(
+            content, self.max_tool_output_tokens, self.model
+        )
+        if truncated != content:
+            truncated += " ...(truncated)"
+        return truncated
+
+    def update(self, history: list[HistoryEntry]) -> list[dict[str, Any]]:
+        """
+        Render the entries added since the last call and return the context
+        messages
+        """
+        if len(history) < self._rendered:  # history was replaced
+            self._messages.clear()
+            self._message_tokens.clear()
+            self._rendered = 0
+            self._summary = ""
+            self._summarized = 0
+            self._context = None
+        for h in history[self._rendered :]:
+            message = h.to_message(self._truncate_output)
+            if message:
+                self._messages.append(message)
+                self._message_tokens.append(
+                    count_tokens(message_text(message), self.model)
+                )
+                self._context = None
+        self._rendered = len(history)
+
+        if self._context is None:
+            self._context = self._build()
+        return list(self._context)
+
+    def _build(self) -> list[dict[str, Any]]:
+        summary_tokens = count_tokens(self._summary, self.model)
+        budget = self.max_tokens - summary_tokens
+        # Keep the most recent messages verbatim, at least the last one
+        start = len(self._messages)
+        while start > 0:
+            tokens = self._message_tokens[start - 1]
+            if budget < tokens and start < len(self._messages):
+                break
+            budget -= tokens
+            start -= 1
+        # Tool outputs cannot be separated from the call that requested them
+        while (
+            0 < start < len(self._messages)
+            and self._messages[start]["role"] == "tool"
+        ):
+            start -= 1
+
+        if start > self._summarized:
+            self._refresh_summary(start)
+        start = max(start, self._summarized)
+
+        context = []
+        if self._summary:
+            summary = f"Summary of the earlier conversation: {self._summary}"
+            context.append({"role": "system", "content": summary})
+        elif start > 0:
+            omitted = f"({start} earlier messages are omitted)"
+            context.append({"role": "system", "content": omitted})
+        context.extend(self._messages[start:])
+        return context
+
+    def cancel_summary(self) -> None:
+        """
+        Stop the summary being generated, e.g. when the user left the chat
+        """
+        if self._summary_task is not None:
+            self._summary_task.cancel()
+
+    def _refresh_summary(self, end: int) -> None:
+        if self.summarizer is None or self._summary_task is not None:
+            return
+        lines = truncate_tokens(
+            "".join(
+                message_text(message)
+                for message in self._messages[self._summarized : end]
+            ),
+            self.max_tokens,
+            self.model,
+        )
+
+        async def _run(summarizer: Summarizer) -> None:
+            try:
+                self._summary = await summarizer(self._summary, lines)
+                self._summarized = end
+                self._context = None
+            except Exception as e:
+                logger.error(f"ConversationContext: summary error: {e}")
+            finally:
+                self._summary_task = None
+
+        self._summary_task = asyncio.get_running_loop().create_task(
+            _run(self.summarizer)
+        )
@@ -0,0 +1,99 @@
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING
+from urllib.parse import urlsplit
+
+from src.config import get_tool_settings
+
+# requests and httpx are imported on first use to keep startup cheap
+if TYPE_CHECKING:
+    import httpx
+    import requests
+
+_session: "requests.Session | None" = None
+_async_client: "httpx.AsyncClient | None" = None
+_host_semaphores: dict[str, asyncio.Semaphore] = {}
+
+
+def get_timeout() -> tuple[float, float]:
+    """
+    Return the (connect, read) timeout for tool HTTP requests
+    """
+    tool_settings = get_tool_settings()
+    return (
+        tool_settings["http_connect_timeout"],
+        tool_settings["http_read_timeout"],
+    )
+
+
+def get_session() -> "requests.Session":
+    """
+    Return the process-wide keep-alive session used by sync tool requests.
+    Each host gets its own pool of at most `http_max_per_host` connections.
+    """
+    global _session
+    if _session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        tool_settings = get_tool_settings()
+        adapter = HTTPAdapter(
+            pool_connections=tool_settings["http_pool_size"],
+            pool_maxsize=tool_settings["http_max_per_host"],
+            pool_block=True,
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _session = session
+    return _session
+
+
+def get_async_client() -> "httpx.AsyncClient":
+    """
+    Return the process-wide keep-alive client used by async tool requests
+    """
+    global _async_client
+    if _async_client is None:
+        import httpx
+
+        tool_settings = get_tool_settings()
+        connect_timeout, read_timeout = get_timeout()
+        _async_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=tool_settings["http_pool_size"],
+                max_keepalive_connections=tool_settings["http_pool_size"],
+                keepalive_expiry=tool_settings["http_keepalive_expiry"],
+            ),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        )
+    return _async_client
+
+
+@asynccontextmanager
+async def host_slot(url: str) -> AsyncIterator[None]:
+    """
+    Limit the number of concurrent async requests to the host of `url`.
+    httpx only bounds the pool as a whole, so the per-host limit lives here.
+    """
+    host = urlsplit(url).netloc
+    semaphore = _host_semaphores.get(host)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(get_tool_settings()["http_max_per_host"])
+        _host_semaphores[host] = semaphore
+    async with semaphore:
+        yield
+
+
+async def aclose() -> None:
+    """
+    Close the pooled connections, e.g. on application shutdown
+    """
+    global _session, _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    if _session is not None:
+        _session.close()
+        _session = None
@@ -1,62 +1,264 @@
+import asyncio
 import logging
-from collections.abc import AsyncGenerator
-from typing import Any
-
-from openai import AsyncOpenAI, AsyncStream
-from openai.types.chat.chat_completion import ChatCompletion
-from openai.types.chat.chat_completion_chunk import (
-    ChatCompletionChunk,
-    ChoiceDeltaToolCall,
+import threading
+from collections.abc import AsyncGenerator, Callable
+from typing import TYPE_CHECKING, Any
+
+from src.config import get_resilience_settings
+from src.core.rate_limit import get_model_limiter
+from src.core.resilience import (
+    CompletionError,
+    StreamInterrupted,
+    backoff_delay,
+    count_cancelled,
+    get_circuit_breaker,
+    is_retryable,
+    resilience_stats,
+    retry_after,
 )
+from src.core.tokens import count_tokens
+from src.prompts import RESUME_PROMPT
+
+# The openai package takes a noticeable part of the startup time, so it is
+# imported when the first client is created
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, AsyncStream
+    from openai.types.chat.chat_completion_chunk import (
+        ChatCompletionChunk,
+        ChoiceDeltaToolCall,
+    )
+    from openai.types.completion_usage import CompletionUsage
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Process-wide token usage, cached_tokens shows how much the prompt cache saves
+usage_stats = {"prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+
+
+def record_usage(usage: "CompletionUsage") -> None:
+    cached_tokens = 0
+    if usage.prompt_tokens_details:
+        cached_tokens = usage.prompt_tokens_details.cached_tokens or 0
+    usage_stats["prompt_tokens"] += usage.prompt_tokens
+    usage_stats["cached_tokens"] += cached_tokens
+    usage_stats["completion_tokens"] += usage.completion_tokens
+    logger.info(
+        f"Usage: prompt_tokens={usage.prompt_tokens}, "
+        f"{cached_tokens=}, completion_tokens={usage.completion_tokens}"
+    )
+
 
 class ChatOpenAIClient:
-    def __init__(self, client: AsyncOpenAI):
-        self.client = client
+    """
+    Chat completions client. Unless an AsyncOpenAI client is given, it is
+    created with `client_kwargs` on first use.
+    """
+
+    def __init__(
+        self, client: "AsyncOpenAI | None" = None, **client_kwargs: Any
+    ) -> None:
+        self._client = client
+        self._client_kwargs = client_kwargs
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> "AsyncOpenAI":
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from openai import AsyncOpenAI
+
+                    self._client = AsyncOpenAI(**self._client_kwargs)
+        return self._client
+
+    async def warm_up(self) -> None:
+        """
+        Create the client in a worker thread, ahead of the first completion
+        """
+        try:
+            await asyncio.to_thread(lambda: self.client)
+        except Exception as e:
+            logger.error(f"Failed to create the OpenAI client: {e}")
 
     async def stream_completion(
         self,
         messages: list[dict[str, Any]],
         tools: list | None = None,
         settings: dict | None = None,
+        on_usage: Callable[["CompletionUsage"], None] | None = None,
     ) -> AsyncGenerator[
-        tuple[str | None, list[ChoiceDeltaToolCall] | None], None
+        tuple[str | None, "list[ChoiceDeltaToolCall] | None"], None
     ]:
         """
         Streams the completion of a chat message.
+        Failed requests are retried with backoff, on the fallback model once
+        the main model failed. If the stream drops after content was
+        yielded, the model is asked to continue the partial response.
 
         Args:
             messages: Message history
             tools: List of available tools
             settings: OpenAI API settings
+            on_usage: Called with the token usage at the end of each request
 
         Yields:
             tuple[content, tool_call]: A combination of content and tool call
+
+        Raises:
+            CompletionError: No attempt succeeded
         """
-        stream: ChatCompletion | AsyncStream[ChatCompletionChunk]
-        current_settings = settings or {}
+        resilience_settings = get_resilience_settings()
+        current_settings = dict(settings or {})
         if tools:
             current_settings["tools"] = tools
-        try:
-            stream = await self.client.chat.completions.create(  # type: ignore
-                messages=messages,  # type: ignore
-                stream=True,
-                **current_settings,
-            )
-            if isinstance(stream, ChatCompletion):
-                raise ValueError("Expected AsyncStream but got ChatCompletion")
-            async_stream: AsyncStream[ChatCompletionChunk] = stream
-        except Exception as e:
-            logger.error(f"Failed to create chat completion: {e}")
-            return
+        models = [current_settings.get("model", "")]
+        if resilience_settings["fallback_model"]:
+            models.append(resilience_settings["fallback_model"])
 
-        async for part in async_stream:
-            if not part.choices:
+        partial = ""
+        attempt = 0
+        while True:
+            model = self._pick_model(models, attempt)
+            if model is None:
+                resilience_stats["rejected"] += 1
+                raise CompletionError("All models are unavailable")
+            if model != models[0]:
+                resilience_stats["fallbacks"] += 1
+            request_messages = messages
+            if partial:
+                request_messages = [
+                    *messages,
+                    {"role": "assistant", "content": partial},
+                    {"role": "system", "content": RESUME_PROMPT},
+                ]
+            breaker = get_circuit_breaker(model)
+            try:
+                async for content, tool_calls in self._stream_once(
+                    request_messages,
+                    {**current_settings, "model": model},
+                    on_usage,
+                ):
+                    if content:
+                        partial += content
+                    yield content, tool_calls
+            except Exception as e:
+                if not is_retryable(e):
+                    resilience_stats["failures"] += 1
+                    logger.error(f"Failed to create chat completion: {e}")
+                    raise CompletionError(str(e)) from e
+                breaker.record_failure()
+                attempt += 1
+                if attempt > resilience_settings["max_retries"]:
+                    resilience_stats["failures"] += 1
+                    logger.error(
+                        f"Chat completion failed after {attempt} attempts: {e}"
+                    )
+                    raise CompletionError(str(e)) from e
+                delay = backoff_delay(attempt, retry_after(e))
+                resilience_stats["retries"] += 1
+                if partial:
+                    resilience_stats["resumes"] += 1
+                logger.warning(
+                    f"Chat completion failed ({model=}, {attempt=}), "
+                    f"retrying in {delay:.1f}s: {e}"
+                )
+                await asyncio.sleep(delay)
                 continue
-            new_delta = part.choices[0].delta
-            tool_calls = part.choices[0].delta.tool_calls
-            if new_delta.content or tool_calls:
-                yield new_delta.content, tool_calls
+            breaker.record_success()
+            return
+
+    def _pick_model(self, models: list[str], attempt: int) -> str | None:
+        """
+        The main model first, the fallback model for retries, skipping
+        models whose circuit is open
+        """
+        if attempt > 0 and len(models) > 1:
+            models = models[1:] + models[:1]
+        for model in models:
+            if get_circuit_breaker(model).allow():
+                return model
+        return None
+
+    async def _stream_once(
+        self,
+        messages: list[dict[str, Any]],
+        settings: dict[str, Any],
+        on_usage: Callable[["CompletionUsage"], None] | None,
+    ) -> AsyncGenerator[
+        tuple[str | None, "list[ChoiceDeltaToolCall] | None"], None
+    ]:
+        """
+        One streaming request. Tool call deltas are held back until the
+        response is complete, so that a dropped request can be sent again
+        without duplicating them.
+
+        The request waits for the rate limit budget of the model first.
+
+        The HTTP response is closed as soon as the stream is cancelled or
+        closed early, so that the model stops generating.
+
+        Raises:
+            StreamInterrupted: The stream ended without a finish reason
+        """
+        from openai.types.chat.chat_completion import ChatCompletion
+
+        limiter = get_model_limiter(settings["model"])
+        if limiter:
+            # Providers count the prompt and max_tokens against the budget
+            await limiter.acquire(
+                sum(
+                    count_tokens(m.get("content") or "", settings["model"])
+                    for m in messages
+                )
+                + settings.get("max_tokens", 0)
+            )
+        stream = await self.client.chat.completions.create(  # type: ignore
+            messages=messages,  # type: ignore
+            stream=True,
+            stream_options={"include_usage": True},
+            **settings,
+        )
+        if isinstance(stream, ChatCompletion):
+            raise ValueError("Expected AsyncStream but got ChatCompletion")
+        async_stream: "AsyncStream[ChatCompletionChunk]" = stream
+
+        tool_calls_buffer: "list[ChoiceDeltaToolCall]" = []
+        received: list[str] = []
+        finished = False
+        try:
+            async for part in async_stream:
+                if part.usage:  # the last chunk, without choices
+                    record_usage(part.usage)
+                    if on_usage:
+                        on_usage(part.usage)
+                if not part.choices:
+                    continue
+                if part.choices[0].finish_reason:
+                    finished = True
+                new_delta = part.choices[0].delta
+                if new_delta.tool_calls:
+                    tool_calls_buffer.extend(new_delta.tool_calls)
+                if new_delta.content:
+                    received.append(new_delta.content)
+                    yield new_delta.content, None
+        except (asyncio.CancelledError, GeneratorExit):
+            # No usage chunk comes for a cancelled stream, the tokens
+            # generated so far are estimated
+            received.extend(
+                tool_call.function.arguments or ""
+                for tool_call in tool_calls_buffer
+                if tool_call.function
+            )
+            count_cancelled("completions")
+            count_cancelled(
+                "completion_tokens",
+                count_tokens("".join(received), settings["model"]),
+            )
+            raise
+        finally:
+            await async_stream.close()
+        if not finished:
+            raise StreamInterrupted("The stream ended before the response")
+        if tool_calls_buffer:
+            yield None, tool_calls_buffer
@@ -0,0 +1,216 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from src.config import get_rate_limit_settings
+
+# Request priorities, lower is served first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+_current_session: ContextVar[str] = ContextVar(
+    "rate_limit_session", default=""
+)
+_current_priority: ContextVar[int] = ContextVar(
+    "rate_limit_priority", default=INTERACTIVE
+)
+
+
+@contextmanager
+def scheduling(
+    session: str | None = None, priority: int | None = None
+) -> Iterator[None]:
+    """
+    Set the session and the priority of the requests made in the block,
+    including those of tasks started in it
+    """
+    session_token = (
+        _current_session.set(session) if session is not None else None
+    )
+    priority_token = (
+        _current_priority.set(priority) if priority is not None else None
+    )
+    try:
+        yield
+    finally:
+        if priority_token is not None:
+            _current_priority.reset(priority_token)
+        if session_token is not None:
+            _current_session.reset(session_token)
+
+
+class TokenBucket:
+    """
+    Budget of `per_minute` units, refilled continuously
+    """
+
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.available = per_minute
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(
+            self.capacity, self.available + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def delay(self, amount: float) -> float:
+        """
+        Seconds until `amount` units are available
+        """
+        self._refill()
+        missing = min(amount, self.capacity) - self.available
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.available -= min(amount, self.capacity)
+
+
+class _Waiter:
+    __slots__ = ("future", "tokens")
+
+    def __init__(self, future: asyncio.Future[None], tokens: int) -> None:
+        self.future = future
+        self.tokens = tokens
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute budget shared by all sessions.
+
+    Waiting requests are served by priority, and round-robin across sessions
+    within a priority, so that one busy session can't hold up the others and
+    background work waits for interactive work.
+    """
+
+    def __init__(
+        self, name: str, rpm: float | None, tpm: float | None = None
+    ) -> None:
+        self.name = name
+        self._buckets: list[tuple[TokenBucket, bool]] = []
+        if rpm:
+            self._buckets.append((TokenBucket(rpm), False))
+        if tpm:
+            self._buckets.append((TokenBucket(tpm), True))
+        # priority -> session -> waiting requests of the session
+        self._waiting: dict[int, OrderedDict[str, deque[_Waiter]]] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        self.stats = {"granted": 0, "delayed": 0, "wait_seconds": 0.0}
+
+    def _delay(self, tokens: int) -> float:
+        return max(
+            (
+                bucket.delay(tokens if is_tokens else 1)
+                for bucket, is_tokens in self._buckets
+            ),
+            default=0.0,
+        )
+
+    def _take(self, tokens: int) -> None:
+        for bucket, is_tokens in self._buckets:
+            bucket.take(tokens if is_tokens else 1)
+        self.stats["granted"] += 1
+
+    async def acquire(self, tokens: int = 0) -> None:
+        """
+        Wait until the request, estimated at `tokens` tokens, fits the budget
+        """
+        if not self._waiting and self._delay(tokens) == 0:
+            self._take(tokens)
+            return
+
+        future: asyncio.Future[None] = (
+            asyncio.get_running_loop().create_future()
+        )
+        sessions = self._waiting.setdefault(
+            _current_priority.get(), OrderedDict()
+        )
+        sessions.setdefault(_current_session.get(), deque()).append(
+            _Waiter(future, tokens)
+        )
+        started_at = time.monotonic()
+        self._dispatch()
+        try:
+            await future
+        finally:
+            if future.cancelled():
+                self._dispatch()
+            self.stats["delayed"] += 1
+            self.stats["wait_seconds"] += time.monotonic() - started_at
+
+    def _next(self) -> tuple[_Waiter, str, OrderedDict] | None:
+        for priority in sorted(self._waiting):
+            sessions = self._waiting[priority]
+            for session, waiters in list(sessions.items()):
+                while waiters and waiters[0].future.done():
+                    waiters.popleft()  # cancelled while waiting
+                if not waiters:
+                    del sessions[session]
+                    continue
+                return waiters[0], session, sessions
+            del self._waiting[priority]
+        return None
+
+    def _dispatch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while (selected := self._next()) is not None:
+            waiter, session, sessions = selected
+            delay = self._delay(waiter.tokens)
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(
+                    delay, self._dispatch
+                )
+                return
+            self._take(waiter.tokens)
+            sessions[session].popleft()
+            # The session goes to the back of the line of its priority
+            sessions.move_to_end(session)
+            waiter.future.set_result(None)
+
+
+_limiters: dict[str, RateLimiter | None] = {}
+
+
+def _get_limiter(
+    name: str, budgets: dict[str, dict[str, float]]
+) -> RateLimiter | None:
+    if name not in _limiters:
+        budget = budgets.get(name) or budgets.get("default")
+        if not get_rate_limit_settings()["enabled"] or not budget:
+            _limiters[name] = None
+        else:
+            _limiters[name] = RateLimiter(
+                name, budget.get("rpm"), budget.get("tpm")
+            )
+    return _limiters[name]
+
+
+def get_model_limiter(model: str) -> RateLimiter | None:
+    """
+    Return the limiter of the OpenAI model, or None if it has no budget
+    """
+    return _get_limiter(model, get_rate_limit_settings()["models"])
+
+
+def get_endpoint_limiter(endpoint: str) -> RateLimiter | None:
+    """
+    Return the limiter of the Dify endpoint, or None if it has no budget
+    """
+    return _get_limiter(endpoint, get_rate_limit_settings()["dify_endpoints"])
+
+
+def get_rate_limit_stats() -> dict[str, dict[str, float]]:
+    return {
+        name: dict(limiter.stats)
+        for name, limiter in _limiters.items()
+        if limiter is not None
+    }
@@ -0,0 +1,205 @@
+import email.utils
+import random
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any
+
+from src.config import get_resilience_settings
+
+# Process-wide counters, exported with the other metrics
+resilience_stats = {
+    "retries": 0,
+    "fallbacks": 0,
+    "resumes": 0,
+    "failures": 0,
+    "rejected": 0,
+}
+# Work stopped because the user pressed stop, left the chat or sent a new
+# message: turns, completions and the tokens they had already generated,
+# and tool calls
+cancellation_stats = {
+    "turns": 0,
+    "completions": 0,
+    "completion_tokens": 0,
+    "tool_calls": 0,
+}
+
+# Work stopped within the current turn, counted in cancellation_stats only
+# once the turn itself is known to be cancelled
+_stopped_work: ContextVar[dict[str, int] | None] = ContextVar(
+    "stopped_work", default=None
+)
+
+
+def count_cancelled(kind: str, amount: int = 1) -> None:
+    """
+    Count cancelled work, e.g. a completion stream closed early
+    """
+    stopped = _stopped_work.get()
+    if stopped is None:
+        cancellation_stats[kind] += amount
+    else:
+        stopped[kind] = stopped.get(kind, 0) + amount
+
+
+@contextmanager
+def tracking_cancellations() -> Iterator[dict[str, int]]:
+    """
+    Collect the work cancelled in the block instead of counting it, so that
+    work stopped by a deadline isn't counted as a cancellation
+    """
+    stopped: dict[str, int] = {}
+    token = _stopped_work.set(stopped)
+    try:
+        yield stopped
+    finally:
+        _stopped_work.reset(token)
+
+
+class CompletionError(Exception):
+    """
+    A completion could not be produced, even after retries and fallback
+    """
+
+
+class StreamInterrupted(Exception):
+    """
+    The stream ended before the model finished its response
+    """
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Whether a failed request may succeed when sent again: rate limits,
+    server errors, timeouts and dropped connections
+    """
+    import httpx
+    import openai
+
+    if isinstance(error, (StreamInterrupted, httpx.TransportError)):
+        return True
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def retry_after(error: Exception) -> float | None:
+    """
+    Seconds to wait as told by the Retry-After headers of the response
+    """
+    response = getattr(error, "response", None)
+    headers: Any = getattr(response, "headers", None)
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def backoff_delay(attempt: int, retry_after_seconds: float | None) -> float:
+    """
+    Exponential backoff with full jitter, or the delay the server asked for
+    if it is longer. `attempt` starts at 1.
+    """
+    settings = get_resilience_settings()
+    ceiling = min(
+        settings["backoff_max"],
+        settings["backoff_base"] * 2 ** (attempt - 1),
+    )
+    delay = random.uniform(0, ceiling)
+    if retry_after_seconds is not None:
+        delay = max(delay, min(retry_after_seconds, settings["backoff_max"]))
+    return delay
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a model after `failure_threshold` consecutive
+    failures. After `reset_timeout` seconds one trial request is let through
+    (half-open), and its result closes or reopens the circuit. A trial
+    that never reports back is replaced by another after `reset_timeout`.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._trial_started_at: float | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            now = time.monotonic()
+            if state == "half-open" and (
+                self._trial_started_at is None
+                or now - self._trial_started_at >= self.reset_timeout
+            ):
+                self._trial_started_at = now
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_started_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_started_at = None
+            if (
+                self.opened_at is not None
+                or self.failures >= self.failure_threshold
+            ):
+                self.opened_at = time.monotonic()
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+
+
+def get_circuit_breaker(model: str) -> CircuitBreaker:
+    """
+    Return the circuit breaker of the model, shared by all sessions
+    """
+    breaker = _breakers.get(model)
+    if breaker is None:
+        settings = get_resilience_settings()
+        breaker = CircuitBreaker(
+            settings["circuit_failure_threshold"],
+            settings["circuit_reset_timeout"],
+        )
+        _breakers[model] = breaker
+    return breaker
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import threading
+from typing import Any
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Approximation used until the tokenizer of the model is loaded, or when it
+# can't be: ASCII text takes about 4 characters per token, while other text
+# (Japanese) takes about one token per character
+CHARS_PER_TOKEN = 4
+
+# model -> tiktoken encoding, or None if it can't be loaded
+_encodings: dict[str, Any] = {}
+_loading: set[str] = set()
+_lock = threading.Lock()
+
+
+def _load_encoding(model: str) -> Any:
+    """
+    Import tiktoken and load the encoding of `model`. The BPE file is
+    downloaded on first use, so this is never run on the event loop.
+    """
+    import tiktoken
+
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+    except Exception as e:  # e.g. the BPE file cannot be downloaded
+        logger.warning(f"tiktoken is not available for {model}: {e}")
+        encoding = None
+    _encodings[model] = encoding
+    return encoding
+
+
+async def load_encoding(model: str) -> None:
+    """
+    Load the tokenizer of `model` in a worker thread, e.g. at start-up
+    """
+    if model not in _encodings:
+        await asyncio.to_thread(_load_encoding, model)
+
+
+def _get_encoding(model: str) -> Any:
+    if model in _encodings:
+        return _encodings[model]
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return _load_encoding(model)
+    # On the event loop: estimate until the encoding is loaded in the
+    # background
+    with _lock:
+        if model not in _loading:
+            _loading.add(model)
+            threading.Thread(
+                target=_load_encoding, args=(model,), daemon=True
+            ).start()
+    return None
+
+
+def _estimate_tokens(text: str) -> int:
+    ascii_chars = sum(1 for c in text if c.isascii())
+    return -(-ascii_chars // CHARS_PER_TOKEN) + len(text) - ascii_chars
+
+
+def count_tokens(text: str, model: str) -> int:
+    """
+    Count the tokens of `text` for `model`.
+    Falls back to a character-based estimate without the tokenizer.
+    """
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return _estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, model: str) -> str:
+    """
+    Cut `text` down to at most `max_tokens` tokens
+    """
+    encoding = _get_encoding(model)
+    if encoding is None:
+        budget = max_tokens * CHARS_PER_TOKEN
+        for index, c in enumerate(text):
+            budget -= 1 if c.isascii() else CHARS_PER_TOKEN
+            if budget < 0:
+                return text[:index]
+        return text
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
@@ -0,0 +1,158 @@
+import sys
+from collections.abc import Callable
+from typing import Any
+
+# Kinds of history entries
+USER = "user"
+THOUGHT = "thought"  # reasoning output, not sent back to the model
+ANSWER = "answer"
+TOOL_CALLS = "tool_calls"
+TOOL_OUTPUT = "tool_output"
+
+# Short codes of the kinds in `to_record`
+_CODES = {
+    USER: "u",
+    THOUGHT: "r",
+    ANSWER: "a",
+    TOOL_CALLS: "c",
+    TOOL_OUTPUT: "t",
+}
+_KINDS = {code: kind for kind, code in _CODES.items()}
+
+# Sent in place of an empty tool output
+EMPTY_TOOL_OUTPUT = "(empty result)"
+
+
+class ToolCall:
+    """
+    A function call requested by the model
+    """
+
+    __slots__ = ("id", "name", "arguments")
+
+    def __init__(self, id: str, name: str, arguments: str) -> None:
+        self.id = id
+        # Tool names repeat in every session, one string object serves all
+        self.name = sys.intern(name)
+        self.arguments = arguments
+
+    def to_message(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "type": "function",
+            "function": {"name": self.name, "arguments": self.arguments},
+        }
+
+    def __repr__(self) -> str:
+        return (
+            f"ToolCall(id={self.id!r}, name={self.name!r}, "
+            f"arguments={self.arguments!r})"
+        )
+
+
+class HistoryEntry:
+    """
+    One entry of the conversation history of a session.
+    `content` is the text of user, thought, answer and tool output entries,
+    `tool_calls` the calls of a tool calls entry, and `tool_call_id`/`name`
+    identify the call a tool output answers.
+    """
+
+    __slots__ = ("kind", "content", "tool_calls", "tool_call_id", "name")
+
+    def __init__(
+        self,
+        kind: str,
+        content: str = "",
+        tool_calls: tuple[ToolCall, ...] = (),
+        tool_call_id: str = "",
+        name: str = "",
+    ) -> None:
+        self.kind = kind
+        self.content = content
+        self.tool_calls = tool_calls
+        self.tool_call_id = tool_call_id
+        self.name = sys.intern(name)
+
+    @classmethod
+    def user(cls, content: str) -> "HistoryEntry":
+        return cls(USER, content)
+
+    @classmethod
+    def thought(cls, content: str) -> "HistoryEntry":
+        return cls(THOUGHT, content)
+
+    @classmethod
+    def answer(cls, content: str) -> "HistoryEntry":
+        return cls(ANSWER, content)
+
+    @classmethod
+    def calls(cls, tool_calls: list[ToolCall]) -> "HistoryEntry":
+        return cls(TOOL_CALLS, tool_calls=tuple(tool_calls))
+
+    @classmethod
+    def tool_output(
+        cls, tool_call_id: str, name: str, content: str
+    ) -> "HistoryEntry":
+        return cls(TOOL_OUTPUT, content, tool_call_id=tool_call_id, name=name)
+
+    def to_message(
+        self, truncate_output: Callable[[str], str] = str
+    ) -> dict[str, Any] | None:
+        """
+        The entry in the OpenAI chat message format, or None for entries
+        that are not sent to the model (thoughts and empty answers).
+        Tool outputs are always sent, as every tool call needs its answer.
+        """
+        kind = self.kind
+        if kind == USER:
+            return {"role": "user", "content": self.content}
+        if kind == ANSWER and self.content:
+            return {"role": "assistant", "content": self.content}
+        if kind == TOOL_CALLS:
+            return {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    tool_call.to_message() for tool_call in self.tool_calls
+                ],
+            }
+        if kind == TOOL_OUTPUT:
+            return {
+                "role": "tool",
+                "tool_call_id": self.tool_call_id,
+                "content": (
+                    truncate_output(self.content)
+                    if self.content
+                    else EMPTY_TOOL_OUTPUT
+                ),
+            }
+        return None
+
+    def to_record(self) -> list[Any]:
+        """
+        Compact JSON-serializable form:
+        [code, content], [code, [[id, name, arguments], ...]] for tool calls
+        and [code, content, tool_call_id, name] for tool outputs
+        """
+        code = _CODES[self.kind]
+        if self.kind == TOOL_CALLS:
+            return [
+                code,
+                [[c.id, c.name, c.arguments] for c in self.tool_calls],
+            ]
+        if self.kind == TOOL_OUTPUT:
+            return [code, self.content, self.tool_call_id, self.name]
+        return [code, self.content]
+
+    @classmethod
+    def from_record(cls, record: list[Any]) -> "HistoryEntry":
+        kind = _KINDS[record[0]]
+        if kind == TOOL_CALLS:
+            return cls.calls([ToolCall(*call) for call in record[1]])
+        if kind == TOOL_OUTPUT:
+            return cls.tool_output(record[2], record[3], record[1])
+        return cls(kind, record[1])
+
+    def __repr__(self) -> str:
+        return f"HistoryEntry({self.to_record()!r})"
@@ -1,39 +1,90 @@
 import os
+from importlib.metadata import EntryPoint, entry_points
 from pathlib import Path
 from typing import Any
 
-from openai import AsyncOpenAI
-
+from src.config import get_memory_settings, get_settings
 from src.core.openai_module import ChatOpenAIClient
 from src.memory import ExperimentalMemory
-from src.tools import (
-    BaseTool,
-    GetRepresentativeTelephoneTool,
-    GoogleSearchTool,
-    MemoryUpdaterTool,
-)
+from src.memory_store import InProcessMemoryStore
+from src.tools import BaseTool
 
+# Entry point group of tool plugins. A plugin package registers its BaseTool
+# subclasses in its pyproject.toml:
+#   [project.entry-points."reasoning_chat.tools"]
+#   my_tool = "my_package.my_module:MyTool"
+TOOL_ENTRY_POINT_GROUP = "reasoning_chat.tools"
+# Built-in tools, in the same form as entry points. This project is not
+# installed as a package, so it can't declare them as entry points itself.
+BUILTIN_TOOLS = {
+    "get_representative_telephone": (
+        "src.tools.dify_telephone:GetRepresentativeTelephoneTool"
+    ),
+    "googlesearch": "src.tools.dify_googlesearch:GoogleSearchTool",
+    "memory_updater": "src.tools.memory_updater:MemoryUpdaterTool",
+    "search_attachments": "src.tools.attachment_search:AttachmentSearchTool",
+}
 
-def initialize() -> tuple[
-    ChatOpenAIClient,
-    ExperimentalMemory,
-    list[BaseTool],
-    list[dict],
-    dict[str, dict[str, Any]],
-]:
-    client = ChatOpenAIClient(AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY")))
-    memory = ExperimentalMemory(Path("src/memories"))
+
+def discover_tools() -> list[EntryPoint]:
+    """
+    Find the built-in and plugin tools without importing their modules.
+    A plugin with the name of a built-in tool replaces it.
+    """
+    found = {
+        name: EntryPoint(name, value, TOOL_ENTRY_POINT_GROUP)
+        for name, value in BUILTIN_TOOLS.items()
+    }
+    for entry_point in entry_points(group=TOOL_ENTRY_POINT_GROUP):
+        found[entry_point.name] = entry_point
+    return list(found.values())
+
+
+def create_tools(
+    memory: ExperimentalMemory,
+) -> tuple[list[BaseTool], list[dict], dict[str, dict[str, Any]]]:
+    """
+    Create the tool instances, their OpenAI definitions and the registry
+    used to run them by name
+    """
     tools_instances: list[BaseTool] = [
-        GetRepresentativeTelephoneTool(),
-        GoogleSearchTool(),
-        MemoryUpdaterTool(memory),
+        entry_point.load().create(memory) for entry_point in discover_tools()
     ]
     tools = [instance.definition for instance in tools_instances]
     available_tools: dict[str, dict[str, Any]] = {
         instance.name: {
-            "run": instance.run,
+            "run": instance.invoke,
             "args": list(instance.parameters["properties"].keys()),
         }
         for instance in tools_instances
     }
-    return client, memory, tools_instances, tools, available_tools
+    return tools_instances, tools, available_tools
+
+
+def initialize(memory_backend: str | None = None) -> tuple[
+    ChatOpenAIClient,
+    ExperimentalMemory,
+    list[BaseTool],
+    list[dict],
+    dict[str, dict[str, Any]],
+]:
+    """
+    Create the client, the memory and the tools.
+    The OpenAI client itself is created on the first completion.
+    `memory_backend` overrides the backend of `memory_settings`.
+    """
+    # Retries are done by ChatOpenAIClient, with fallback and circuit breaker
+    client = ChatOpenAIClient(
+        api_key=os.getenv("OPENAI_API_KEY"), max_retries=0
+    )
+    memory_settings = get_memory_settings()
+    memory_backend = memory_backend or memory_settings["backend"]
+    memory = ExperimentalMemory(
+        Path(memory_settings["memory_dir"]),
+        check_interval=memory_settings["check_interval"],
+        top_k=memory_settings["top_k"],
+        max_tokens=memory_settings["max_tokens"],
+        model=get_settings()["model"],
+        store=(InProcessMemoryStore() if memory_backend == "memory" else None),
+    )
+    return client, memory, *create_tools(memory)
@@ -1,112 +1,175 @@
-import json
+import asyncio
+import functools
 import logging
-from typing import Any
+from collections.abc import AsyncIterator, Awaitable, Callable
+from pathlib import Path
 
 import chainlit as cl
-from openai.types.chat.chat_completion_message_tool_call import (
-    ChatCompletionMessageToolCall,
-    Function,
-)
 
-from src.common import get_main_messages, get_reasoning_messages
-from src.config import get_settings
+from src import telemetry
+from src.agent import AgentLoop, AgentUI
+from src.attachments import attachment_session, get_attachment_index
+from src.config import (
+    get_agent_settings,
+    get_context_settings,
+    get_settings,
+    get_telemetry_settings,
+    get_tool_settings,
+    get_ui_settings,
+)
+from src.context import ConversationContext, ConversationSummarizer
+from src.core import rate_limit
+from src.core.resilience import CompletionError
+from src.core.streaming import coalesce
+from src.core.tokens import load_encoding
+from src.history import HistoryEntry
 from src.initialization import initialize
+from src.session_store import get_session_store
+from src.tools.base_tool import tool_progress
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-client, memory, tools_instances, tools, available_tools = initialize()
-
 settings = get_settings()
+context_settings = get_context_settings()
+ui_settings = get_ui_settings()
 
 
-@cl.step(type="tool")
-async def call_tool(
-    tool_call_id: str,
-    name: str,
-    inputs: str,
-    messages: list[dict[str, Any]],
-) -> dict[str, Any]:
-    logger.info(
-        f"call_tool input: {tool_call_id=}, {name=}, {inputs=}, {messages=}"
+@functools.cache
+def get_agent() -> AgentLoop:
+    """
+    Create the agent on first use, so that the server starts serving before
+    the clients, the memory and the tools are built
+    """
+    client, memory, tools_instances, tools, available_tools = initialize()
+    return AgentLoop(
+        client,
+        memory,
+        tools_instances,
+        tools,
+        available_tools,
+        settings=settings,
+        agent_settings=get_agent_settings(),
+        tool_settings=get_tool_settings(),
     )
-    current_step = cl.context.current_step
-    current_step.name = name
-    current_step.input = inputs
 
-    try:
-        arguments: dict[str, Any] = json.loads(inputs)
-        function_to_call = available_tools[name]["run"]
-        function_args_keys: list[str] = available_tools[name]["args"]
-        function_response = function_to_call(
-            **{arg: arguments.get(arg) for arg in function_args_keys}
+
+telemetry_settings = get_telemetry_settings()
+if telemetry_settings["enabled"] and (
+    telemetry_settings["exporter"] == "prometheus"
+):
+    from chainlit.server import app
+
+    telemetry.mount_metrics(app)
+
+
+class ChainlitUI(AgentUI):
+    """
+    Shows the agent turn as Chainlit steps and messages.
+    Tokens are coalesced into frames, each frame is one websocket message.
+    """
+
+    def _frames(self, tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+        return coalesce(
+            tokens,
+            ui_settings["stream_window"],
+            ui_settings["stream_max_bytes"],
         )
-    except Exception as e:
-        logger.error(f"call_tool error: {e}")
-        return {
-            "role": "tool",
-            "name": name,
-            "content": "Failed to execute the tool.",
-            "tool_call_id": tool_call_id,
-        }
-
-    logger.info(
-        f"call_tool output: {name=}, {arguments=}, {function_response=}"
-    )
 
-    current_step.output = function_response
-    current_step.language = "json"
+    async def reasoning(self, tokens: AsyncIterator[str]) -> None:
+        async with cl.Step(name="reasoning_step", type="llm") as step:
+            async for token in self._frames(tokens):
+                await step.stream_token(token)
+
+    async def answer(self, tokens: AsyncIterator[str]) -> None:
+        response = cl.Message(content="")
+        async for token in self._frames(tokens):
+            if not response.content:
+                await response.send()
+            await response.stream_token(token)
+        if response.content:
+            await response.update()
+
+    async def tool(
+        self, name: str, inputs: str, run: Callable[[], Awaitable[str]]
+    ) -> str:
+        async with cl.Step(name=name, type="tool") as step:
+            step.input = inputs
+            # Partial output is shown while the tool runs, then replaced
+            with tool_progress(step.stream_token):
+                output = await run()
+            step.output = output
+            step.language = "json"
+        return output
+
 
-    tool_output = {
-        "role": "tool",
-        "name": name,
-        "content": function_response,
-        "tool_call_id": tool_call_id,
-    }
-    return tool_output
+def get_conversation() -> ConversationContext:
+    """
+    Return the conversation context of the session. It is created on first
+    use, as a worker serving a turn of a chat started on another worker
+    has none yet.
+    """
+    conversation = cl.user_session.get("conversation")
+    if conversation is None:
+        conversation = ConversationContext(
+            model=settings["model"],
+            max_tokens=context_settings["max_context_tokens"],
+            max_tool_output_tokens=context_settings["max_tool_output_tokens"],
+            summarizer=ConversationSummarizer(
+                get_agent().client,
+                settings,
+                context_settings["max_summary_tokens"],
+            ),
+        )
+        cl.user_session.set("conversation", conversation)
+    return conversation
 
 
 @cl.on_chat_start
 async def start_chat():
-    cl.user_session.set("history", [])
+    agent = get_agent()
+    get_conversation()
 
-    available_tools_str = "\n".join(
-        [
-            f"- {instance.name}: {instance.description}"
-            for instance in tools_instances
-        ]
-    )
+    available_tools_str = agent.available_tools_str
     cl.user_session.set("available_tools_str", available_tools_str)
 
     await cl.Message(
         content=f"I'm an AI agent!\n** Available tools **\n{available_tools_str}",
     ).send()
+    # Import and create the OpenAI client and the tokenizer while the user
+    # is typing
+    await asyncio.gather(
+        agent.client.warm_up(), load_encoding(settings["model"])
+    )
 
 
-@cl.step(type="llm")
-async def reasoning_step(history: list[dict[str, Any]]) -> None:
+async def _replace_turn(task: asyncio.Task | None) -> None:
     """
-    Step to think about a solution.
-    The result is added to history.
-
-    Args:
-        history (list[dict[str, Any]]): The entire conversation history between the user and the AI agent
+    Make `task` the turn of the session, then cancel the previous turn and
+    wait until its history is saved. The swap comes first so that of
+    several messages sent in a row, each one cancels the one before it.
     """
-    available_tools = cl.user_session.get("available_tools")
-    messages = get_reasoning_messages(history, available_tools, memory)
-
-    current_step = cl.context.current_step
+    turn: asyncio.Task | None = cl.user_session.get("turn")
+    cl.user_session.set("turn", task)
+    if turn is None or turn.done() or turn is asyncio.current_task():
+        return
+    turn.cancel()
+    try:
+        await asyncio.wait({turn})
+    except asyncio.CancelledError:
+        # Replaced in turn, the next one waits for both
+        await asyncio.wait({turn})
+        raise
 
-    async for content, _ in client.stream_completion(
-        messages=messages, tools=tools, settings=settings
-    ):
-        if content:
-            await current_step.stream_token(content)
 
-    logger.info(f"Reasoning output: {current_step.output}")
-    history.append({"role": "assistant", "content": current_step.output})
-    cl.user_session.set("history", history)
-    cl.user_session.set("history", history)
+@cl.on_chat_end
+async def end_chat():
+    # Nobody reads the answer once the user has left
+    await _replace_turn(None)
+    conversation = cl.user_session.get("conversation")
+    if conversation:
+        conversation.cancel_summary()
+    await get_session_store().delete(cl.context.session.thread_id)
 
 
 @cl.on_message
@@ -115,94 +178,43 @@ async def main(msg: cl.Message) -> None:
         await cl.Message(content="Please enter a message.").send()
         return
 
+    # A new message replaces the answer still being generated. The stop
+    # button cancels the turn through Chainlit.
+    await _replace_turn(asyncio.current_task())
+
+    session_id = cl.context.session.thread_id
     content = msg.content
     if msg.elements:
+        # Files are indexed for the search_attachments tool instead of being
+        # put into the prompt
+        attachments = get_attachment_index(session_id)
         content += "\n--- Attached files ---\n"
         for file in msg.elements:
-            content += f"- {file.path} ({file.mime})\n"
-    logger.info(f"main user input: {content}")
-
-    history: list[dict[str, Any]] = cl.user_session.get("history")
-    history.append({"role": "user", "content": content})
-
-    # Recursively reasoning, using tools and streaming response
-    async def _stream_response(messages: list[dict[str, Any]]) -> None:
-        # 1. Reasoning step
-        await reasoning_step(history)
-
-        # 2. Streaming response with tool calls
-        available_tools = cl.user_session.get("available_tools")
-        thought = cl.context.current_step.output
-        messages = get_main_messages(history, available_tools, thought, memory)
-        logger.info(f"main messages: {messages}")
-
-        response = cl.Message(content="")
-        tool_calls_buffer: list[ChatCompletionMessageToolCall] = []
-
-        logger.info(f"main tools: {tools}")
-        async for content, tool_calls in client.stream_completion(
-            messages=messages, tools=tools, settings=settings
+            if not file.path:
+                continue
+            status = await attachments.ingest(
+                Path(file.path), file.mime or "", file.name
+            )
+            content += f"- {file.name} ({file.mime}): {status}\n"
+    logger.debug(f"main user input: {content}")
+
+    # The history lives in the session store, so that any worker sharing it
+    # can serve the turn
+    sessions = get_session_store()
+    history = await sessions.load(session_id)
+    history.append(HistoryEntry.user(content))
+
+    conversation = get_conversation()
+    try:
+        with (
+            rate_limit.scheduling(session=session_id),
+            attachment_session(session_id),
         ):
-            if content:
-                if not response.content:
-                    await response.send()
-                await response.stream_token(content)
-
-            if tool_calls:
-                for tool_call in tool_calls:
-                    if tool_call.index >= len(tool_calls_buffer):
-                        tool_calls_buffer.append(
-                            ChatCompletionMessageToolCall(
-                                id=tool_call.id,  # type: ignore
-                                function=Function(
-                                    name=tool_call.function.name,  # type: ignore
-                                    arguments=tool_call.function.arguments,  # type: ignore
-                                ),
-                                type="function",
-                            )
-                        )
-                    else:
-                        if tool_call.function.name:  # type: ignore
-                            tool_calls_buffer[
-                                tool_call.index
-                            ].function.name = tool_call.function.name  # type: ignore
-                        if tool_call.function.arguments:  # type: ignore
-                            tool_calls_buffer[
-                                tool_call.index
-                            ].function.arguments += (
-                                tool_call.function.arguments  # type: ignore
-                            )
-
-        # 3. If there is a tool call, add it to history and execute it
-        if tool_calls_buffer:
-            logger.info(f"main tool calling: {tool_calls_buffer=}")
-            tool_input = {
-                "role": "assistant",
-                "content": None,
-                "tool_calls": tool_calls_buffer,
-            }
-            messages.append(tool_input)
-            history.append(tool_input)
-
-            for tool_call in tool_calls_buffer:  # type: ignore
-                tool_output = await call_tool(
-                    tool_call.id,  # type: ignore
-                    tool_call.function.name,  # type: ignore
-                    tool_call.function.arguments,  # type: ignore
-                    messages,
-                )
-                messages.append(tool_output)
-                history.append(tool_output)
-            cl.user_session.set("history", history)
-
-            # If there is a tool call, recursively execute reasoning step
-            await _stream_response(messages)
-        else:
-            # If there is no tool call, add the final response to history
-            logger.info(f"Response: {response.content}")
-            history.append({"role": "assistant", "content": response.content})
-            cl.user_session.set("history", history)
-            await response.update()
-
-    # Start the first processing
-    await _stream_response(messages=[])
+            await get_agent().run_turn(history, conversation, ChainlitUI())
+    except CompletionError:
+        await cl.Message(
+            content="The AI model is not available right now. "
+            "Please try again in a moment."
+        ).send()
+    finally:
+        await sessions.save(session_id, history)
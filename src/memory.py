@@ -1,25 +1,142 @@
-import os
-from datetime import datetime
+import asyncio
+import sys
+import threading
+import time
 from pathlib import Path
 
+from src.core.tokens import count_tokens
+from src.memory_store import MemoryStore, SQLiteMemoryStore
+from src.retrieval import BM25Index
+
 
 class ExperimentalMemory:
-    def __init__(self, memory_dir: Path):
+    """
+    Past experiences saved in a MemoryStore, by default a SQLite store under
+    `memory_dir`.
+    The entries are held in process and indexed with BM25 so prompts only get
+    relevant ones. The store is checked for entries written by other workers
+    at most once per `check_interval` seconds, and only new entries are read.
+    `refresh` does the check off the event loop; `load` and `search` only
+    read the in-process index.
+    """
+
+    def __init__(
+        self,
+        memory_dir: Path,
+        check_interval: float = 1.0,
+        top_k: int = 5,
+        max_tokens: int = 500,
+        model: str = "gpt-4o",
+        store: MemoryStore | None = None,
+    ):
         self.memory_dir = memory_dir
+        self.check_interval = check_interval
+        self.top_k = top_k
+        self.max_tokens = max_tokens
+        self.model = model
+        self._lock = threading.Lock()
+        if store is None:
+            store = SQLiteMemoryStore(memory_dir / "memories.sqlite3")
+            store.import_text_files(memory_dir)
+        self._store = store
+        self._index = BM25Index()
+        self._generation: int | None = None
+        self._last_id = 0
+        self._checked_at: float | None = None
+
+    def _add_entries(self, entries: list[tuple[int, str]]) -> None:
+        for entry_id, text in entries:
+            self._index.add(text)
+            self._last_id = entry_id
+
+    async def refresh(self) -> None:
+        """
+        Read the entries written by other workers, at most once per
+        `check_interval` seconds. The store may wait on a lock of another
+        worker, so it is read in a worker thread.
+        """
+        now = time.monotonic()
+        if (
+            self._checked_at is not None
+            and now - self._checked_at < self.check_interval
+        ):
+            return
+        self._checked_at = now
+        await asyncio.to_thread(self._refresh)
+
+    def _refresh(self) -> None:
+        # The store is read without holding the lock of the index
+        generation, last_id = self._store.version()
+        with self._lock:
+            since = self._last_id if generation == self._generation else 0
+        entries = self._store.read_since(since) if last_id > since else []
+        with self._lock:
+            if generation != self._generation:  # rows were rewritten
+                self._index = BM25Index()
+                self._generation = generation
+                self._last_id = 0
+            # Entries saved by this worker meanwhile are indexed already
+            self._add_entries(
+                [entry for entry in entries if entry[0] > self._last_id]
+            )
 
     def load(self) -> str:
-        memory = ""
-        for file in os.listdir(self.memory_dir):
-            with open(Path(f"{self.memory_dir}/{file}"), "r") as f:
-                memory += f.read()
-        if memory:
-            memory = (
-                f"Please refer to the following past experiences: {memory}"
+        """
+        Return every saved experience
+        """
+        with self._lock:
+            if not self._index.documents:
+                return ""
+            memory = "\n".join(self._index.documents)
+            return f"Please refer to the following past experiences:\n{memory}"
+
+    def search(self, query: str) -> str:
+        """
+        Return the `top_k` experiences most relevant to `query`, within
+        `max_tokens` tokens
+        """
+        with self._lock:
+            selected: list[int] = []
+            total_tokens = 0
+            for doc_id, _ in self._index.search(query, self.top_k):
+                document = self._index.documents[doc_id]
+                tokens = count_tokens(document, self.model)
+                if total_tokens + tokens > self.max_tokens:
+                    continue
+                selected.append(doc_id)
+                total_tokens += tokens
+            if not selected:
+                return ""
+            # Keep saved order so the same experiences render the same way
+            memory = "\n".join(
+                self._index.documents[doc_id] for doc_id in sorted(selected)
             )
-        return memory
+            return f"Please refer to the following past experiences:\n{memory}"
 
     def save(self, memory: str):
-        today = datetime.now().strftime("%Y%m%d")
-        file_path = Path(f"{self.memory_dir}/{today}.txt")
-        with open(file_path, "a") as f:
-            f.write(memory)
+        # One experience per entry, on a single line
+        text = " ".join(memory.split())
+        entry_id = self._store.append(text)
+        with self._lock:
+            if self._generation is not None and entry_id == self._last_id + 1:
+                self._add_entries([(entry_id, text)])
+            else:  # other workers wrote too, read them on the next load
+                self._checked_at = None
+
+    def compact(self) -> int:
+        """
+        Deduplicate the stored experiences
+        """
+        removed = self._store.compact()
+        with self._lock:
+            self._checked_at = None
+        return removed
+
+
+if __name__ == "__main__":
+    # Compaction job, e.g. run periodically: python -m src.memory compact
+    if sys.argv[1:] == ["compact"]:
+        from src.config import get_memory_settings
+
+        memory = ExperimentalMemory(Path(get_memory_settings()["memory_dir"]))
+        print(f"Removed {memory.compact()} duplicated entries")
@@ -0,0 +1,225 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _text_hash(text: str) -> str:
+    normalized = " ".join(text.split()).casefold()
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+class MemoryStore(ABC):
+    """
+    Append-only store of memory entries.
+    `generation` changes whenever existing entries are rewritten by
+    `compact`, so readers know when incremental reads are no longer enough.
+    """
+
+    @abstractmethod
+    def append(self, text: str) -> int:
+        """
+        Append an entry and return its id
+        """
+        pass
+
+    @abstractmethod
+    def version(self) -> tuple[int, int]:
+        """
+        Return (generation, last entry id), a cheap check for changes
+        """
+        pass
+
+    @abstractmethod
+    def read_since(self, last_id: int) -> list[tuple[int, str]]:
+        """
+        Return the (id, text) entries appended after `last_id`, oldest first
+        """
+        pass
+
+    @abstractmethod
+    def compact(self) -> int:
+        """
+        Drop duplicated entries, keeping the oldest one, and return the
+        number of removed entries
+        """
+        pass
+
+
+class InProcessMemoryStore(MemoryStore):
+    """
+    Entries kept in the worker process only, e.g. for tests and benchmarks
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._entries: list[tuple[int, str, str]] = []
+        self._generation = 0
+        self._next_id = 1
+
+    def append(self, text: str) -> int:
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries.append((entry_id, text, _text_hash(text)))
+        return entry_id
+
+    def version(self) -> tuple[int, int]:
+        with self._lock:
+            return self._generation, self._next_id - 1
+
+    def read_since(self, last_id: int) -> list[tuple[int, str]]:
+        with self._lock:
+            return [
+                (entry_id, text)
+                for entry_id, text, _ in self._entries
+                if entry_id > last_id
+            ]
+
+    def compact(self) -> int:
+        with self._lock:
+            seen: set[str] = set()
+            entries = []
+            for entry in self._entries:
+                if entry[2] not in seen:
+                    seen.add(entry[2])
+                    entries.append(entry)
+            removed = len(self._entries) - len(entries)
+            if removed:
+                self._entries = entries
+                self._generation += 1
+        return removed
+
+
+class SQLiteMemoryStore(MemoryStore):
+    """
+    Append-only store of memory entries in SQLite (WAL mode).
+    Every entry is its own row, so appends from concurrent sessions and
+    workers are atomic and never interleave.
+    `generation` changes whenever existing rows are rewritten by `compact`,
+    so readers know when incremental reads are no longer enough.
+    Workers sharing the database file share the memory.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, timeout=10.0, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS memories (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at TEXT NOT NULL,
+                text TEXT NOT NULL,
+                text_hash TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO meta VALUES ('generation', 0);
+            """
+        )
+
+    def append(self, text: str) -> int:
+        """
+        Append an entry and return its id
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO memories (created_at, text, text_hash) "
+                "VALUES (?, ?, ?)",
+                (datetime.now().isoformat(), text, _text_hash(text)),
+            )
+        return cursor.lastrowid or 0
+
+    def version(self) -> tuple[int, int]:
+        """
+        Return (generation, last entry id), a cheap check for changes
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT (SELECT value FROM meta WHERE key = 'generation'), "
+                "(SELECT COALESCE(MAX(id), 0) FROM memories)"
+            ).fetchone()
+        return row[0], row[1]
+
+    def read_since(self, last_id: int) -> list[tuple[int, str]]:
+        """
+        Return the (id, text) entries appended after `last_id`, oldest first
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, text FROM memories WHERE id > ? ORDER BY id",
+                (last_id,),
+            ).fetchall()
+
+    def import_text_files(self, memory_dir: Path) -> int:
+        """
+        Move entries of the legacy daily `YYYYMMDD.txt` files into the store.
+        Imported files are renamed to `*.txt.imported`.
+        """
+        imported = 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for file_path in sorted(memory_dir.glob("*.txt")):
+                    created_at = datetime.fromtimestamp(
+                        file_path.stat().st_mtime
+                    ).isoformat()
+                    for line in file_path.read_text().splitlines():
+                        if not line.strip():
+                            continue
+                        self._conn.execute(
+                            "INSERT INTO memories "
+                            "(created_at, text, text_hash) VALUES (?, ?, ?)",
+                            (created_at, line.strip(), _text_hash(line)),
+                        )
+                        imported += 1
+                    file_path.rename(file_path.with_suffix(".txt.imported"))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if imported:
+            logger.info(f"MemoryStore: imported {imported} legacy entries")
+        return imported
+
+    def compact(self) -> int:
+        """
+        Drop duplicated entries, keeping the oldest one, and return the
+        number of removed entries
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self._conn.execute(
+                    "DELETE FROM memories WHERE id NOT IN ("
+                    "SELECT MIN(id) FROM memories GROUP BY text_hash)"
+                )
+                removed = cursor.rowcount
+                if removed:
+                    self._conn.execute(
+                        "UPDATE meta SET value = value + 1 "
+                        "WHERE key = 'generation'"
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            if removed:
+                self._conn.execute("VACUUM")
+        logger.info(f"MemoryStore: compaction removed {removed} entries")
+        return removed
@@ -0,0 +1,102 @@
+import re
+
+# "always": a reasoning completion before every answer completion
+# "fused": a single completion returning the plan and the answer/tool calls
+# "auto": like "always", but trivial messages skip the reasoning completion
+PLANNING_MODES = ("always", "fused", "auto")
+
+# Small talk that never needs a plan (greetings, thanks, acknowledgements)
+_TRIVIAL_PATTERN = re.compile(
+    r"^(hi|hello|hey|thanks|thank you|ok|okay|bye|good (morning|night)|"
+    r"こんにちは|こんばんは|おはよう|ありがとう|了解|よろしく|はい|いいえ|"
+    r"わかりました|おつかれ|お疲れ)"
+)
+
+
+def is_trivial_message(content: str, max_chars: int) -> bool:
+    """
+    Whether a user message is small talk that can be answered without a plan
+    """
+    text = content.strip().casefold()
+    if len(text) > max_chars or "?" in text or "？" in text:
+        return False
+    return _TRIVIAL_PATTERN.match(text) is not None
+
+
+class PlanAnswerSplitter:
+    """
+    Splits the streamed content of a fused completion into the plan
+    ("Thought:"/"Action(N):" lines) and the answer after the "Answer:" line.
+    Text that may be the beginning of the marker is held back until the next
+    token tells whether it is. The output is also held back until it is
+    known to start with a plan, as the model may answer without one.
+    """
+
+    MARKER = "Answer:"
+    PLAN_PREFIXES = ("Thought:", "Action")
+
+    def __init__(self) -> None:
+        self.plan = ""
+        self.answer_started = False
+        self._answer_emitted = False
+        self._plan_started = False
+        self._pending = ""
+
+    def feed(self, token: str) -> tuple[str, str]:
+        """
+        Return the (plan, answer) parts of `token` that can be emitted now
+        """
+        if self.answer_started:
+            return "", self._answer(token)
+
+        self._pending += token
+        index = self._find_marker()
+        if index >= 0:
+            plan = self._pending[:index]
+            answer = self._pending[index + len(self.MARKER) :]
+            self.plan += plan
+            self.answer_started = True
+            self._pending = ""
+            return plan, self._answer(answer)
+
+        if not self._plan_started:
+            text = self._pending.lstrip()
+            prefixes = (*self.PLAN_PREFIXES, self.MARKER)
+            if any(p.startswith(text) for p in prefixes):
+                return "", ""  # too short to tell yet
+            if not text.startswith(self.PLAN_PREFIXES):
+                # No plan, the whole output is the answer
+                self.answer_started = True
+                answer, self._pending = self._pending, ""
+                return "", self._answer(answer)
+            self._plan_started = True
+
+        # Keep the tail that might still turn into "\nAnswer:"
+        keep = len(self.MARKER)
+        plan, self._pending = self._pending[:-keep], self._pending[-keep:]
+        self.plan += plan
+        return plan, ""
+
+    def flush(self) -> str:
+        """
+        Return the plan text held back at the end of the stream
+        """
+        plan, self._pending = self._pending, ""
+        self.plan += plan
+        return plan
+
+    def _answer(self, text: str) -> str:
+        # Drop the whitespace between the marker and the answer
+        if not self._answer_emitted:
+            text = text.lstrip()
+            self._answer_emitted = bool(text)
+        return text
+
+    def _find_marker(self) -> int:
+        start = 0
+        while (index := self._pending.find(self.MARKER, start)) >= 0:
+            before = self._pending[index - 1] if index else self.plan[-1:]
+            if before in ("", "\n"):
+                return index
+            start = index + 1
+        return -1
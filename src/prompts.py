@@ -1,3 +1,7 @@
+# The system prompt is shared by every completion of a session and must stay
+# byte-identical, so that the provider can cache it as a prompt prefix.
+# Conversation turns follow it as messages, and the instruction of each
+# completion (reasoning, answer, ...) comes last.
 SYSTEM_PROMPT = """\
 You are an AI agent acting as a sales team member of a company.
 In the following conversation, a human user will interact with the AI agent.
@@ -8,17 +12,18 @@ When answering questions, you should refer to tool outputs as much as possible r
 
 The AI agent has access to the following tools:
 {available_tools_str}
+"""
 
 
-{memory}
+MEMORY_PROMPT = """\
 
 
-Here is the previous conversation between the human and AI agent:
-{context}
-User: {query}
+{memory}
+"""
 
 
-Plan devised to solve this:
+ANSWER_PROMPT = """\
+Plan devised to solve the last question of the user:
 {thought}
 
 
@@ -28,29 +33,46 @@ Since the above solution plan has not yet been presented to the user, please con
 
 
 REASONING_PROMPT = """\
-You are an AI agent acting as a sales team member of a company.
-In the following conversation, a human user will interact with the AI agent.
-The human user will ask questions, and the AI agent will take steps to provide well-informed responses.
+Think about how to solve the last question of the user.
 - Thought: First, consider solutions step by step. Lines with this prefix show your thought process.
 - Action(N): Based on your thought process, plan actions as Action1, Action2, and so on.
 
-The AI agent needs to use available tools to find the most up-to-date information.
-When answering questions, you should refer to tool outputs as much as possible rather than relying on your own knowledge.
+Don't write the response to the user yet. Instead, focus only on thinking about how to solve the human user's question.
+Present your final plan concisely and in order.
+Start your output with "Thought:" and begin each subsequent line with "Action(N):".
+"""
 
 
-The AI agent has access to the following tools:
-{available_tools_str}
+FUSED_PROMPT = """\
+First, think about how to solve the last question of the user.
+Start your output with "Thought:" and write each planned action on a line starting with "Action(N):".
+Then call the tools the plan needs. If you can already answer, write a line starting with "Answer:" followed by the response to the user in Japanese.
+"""
 
 
-{memory}
+SUMMARY_PROMPT = """\
+You are summarizing a conversation between a human user and an AI agent acting as a sales team member of a company.
+Update the current summary with the new part of the conversation.
+Keep facts the user asked for, tool results (company names, phone numbers, search findings) and open requests.
+Write the summary as a few concise sentences, without any preamble.
 
 
-Here is the previous conversation between the human and AI agent:
+Current summary:
+{summary}
+
+
+New part of the conversation:
 {context}
-User: {query}
+"""
 
 
-Don't write the response to the user yet. Instead, focus only on thinking about how to solve the human user's question.
-Present your final plan concisely and in order.
-Start your output with "Thought:" and begin each subsequent line with "Action(N):".
+LIMIT_PROMPT = """\
+The time and tool budget for this question has been used up, so no more tools can be called.
+Answer the question in Japanese with the information gathered so far, and tell the user briefly if anything could not be completed.
+"""
+
+
+RESUME_PROMPT = """\
+The response above was cut off by a connection error.
+Continue it exactly from where it stopped, without repeating or commenting on what has already been written.
 """
@@ -0,0 +1,78 @@
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+
+# Latin words and digits, or runs of Japanese/CJK characters
+_TOKEN_PATTERN = re.compile(
+    r"[0-9a-z]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+"
+)
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Split text into index terms.
+    Japanese has no spaces between words, so CJK runs become character
+    bigrams instead of words.
+    """
+    terms = []
+    for match in _TOKEN_PATTERN.findall(text.lower()):
+        if match.isascii() or len(match) == 1:
+            terms.append(match)
+        else:
+            terms.extend(match[i : i + 2] for i in range(len(match) - 1))
+    return terms
+
+
+class BM25Index:
+    """
+    In-memory BM25 index that documents can be added to incrementally
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.documents: list[str] = []
+        self._term_freqs: list[Counter[str]] = []
+        self._lengths: list[int] = []
+        self._total_length = 0
+        self._postings: dict[str, list[int]] = {}
+
+    def add(self, text: str) -> int:
+        """
+        Index a document and return its id
+        """
+        doc_id = len(self.documents)
+        terms = tokenize(text)
+        term_freq = Counter(terms)
+        self.documents.append(text)
+        self._term_freqs.append(term_freq)
+        self._lengths.append(len(terms))
+        self._total_length += len(terms)
+        for term in term_freq:
+            self._postings.setdefault(term, []).append(doc_id)
+        return doc_id
+
+    def search(self, query: str, top_k: int) -> list[tuple[int, float]]:
+        """
+        Return up to `top_k` (doc id, score) pairs, best first
+        """
+        if not self.documents:
+            return []
+        n_docs = len(self.documents)
+        avg_length = self._total_length / n_docs or 1.0
+        scores: defaultdict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(
+                1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5)
+            )
+            for doc_id in postings:
+                tf = self._term_freqs[doc_id][term]
+                norm = self.k1 * (
+                    1 - self.b + self.b * self._lengths[doc_id] / avg_length
+                )
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(top_k, scores.items(), key=lambda s: s[1])
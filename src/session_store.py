@@ -0,0 +1,230 @@
+import asyncio
+import json
+import logging
+import queue
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+
+from src.config import get_session_settings
+from src.history import HistoryEntry
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def encode_entry(entry: HistoryEntry) -> str:
+    return json.dumps(
+        entry.to_record(), ensure_ascii=False, separators=(",", ":")
+    )
+
+
+def decode_entry(data: str) -> HistoryEntry:
+    return HistoryEntry.from_record(json.loads(data))
+
+
+class SessionStore(ABC):
+    """
+    Conversation history of each session. Turns of a session may be served
+    by any worker when the store is shared: the history is loaded at the
+    start of a turn and the new entries are saved at its end.
+    """
+
+    @abstractmethod
+    async def load(self, session_id: str) -> list[HistoryEntry]:
+        pass
+
+    @abstractmethod
+    async def save(self, session_id: str, history: list[HistoryEntry]) -> None:
+        """
+        Persist the entries appended to `history` since it was loaded
+        """
+        pass
+
+    @abstractmethod
+    async def delete(self, session_id: str) -> None:
+        """
+        Drop the history of a session that has ended
+        """
+        pass
+
+    async def aclose(self) -> None:
+        pass
+
+
+class InProcessSessionStore(SessionStore):
+    """
+    Keeps the history objects in the worker, the `max_sessions` most
+    recently used ones
+    """
+
+    def __init__(self, max_sessions: int) -> None:
+        self.max_sessions = max_sessions
+        self._sessions: OrderedDict[str, list[HistoryEntry]] = OrderedDict()
+
+    async def load(self, session_id: str) -> list[HistoryEntry]:
+        history = self._sessions.get(session_id)
+        if history is None:
+            return []
+        self._sessions.move_to_end(session_id)
+        return history
+
+    async def save(self, session_id: str, history: list[HistoryEntry]) -> None:
+        self._sessions[session_id] = history
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    async def delete(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Stores history entries as compact rows in SQLite (WAL mode), so that
+    workers sharing the database file can serve any session.
+    Saves are queued to a writer thread that commits the saves arriving
+    within `batch_window` seconds in one transaction.
+    """
+
+    def __init__(self, path: Path, batch_window: float) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.batch_window = batch_window
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, timeout=10.0, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_entries ("
+            "session_id TEXT NOT NULL, seq INTEGER NOT NULL, "
+            "entry TEXT NOT NULL, PRIMARY KEY (session_id, seq)"
+            ") WITHOUT ROWID"
+        )
+        # Number of entries of each session known to be stored
+        self._saved: dict[str, int] = {}
+        self._queue: queue.Queue[
+            tuple[str, int, list[str], asyncio.Future[None]] | None
+        ] = queue.Queue()
+        self._writer = threading.Thread(
+            target=self._write_loop, name="session-writer", daemon=True
+        )
+        self._writer.start()
+
+    def _read(self, session_id: str) -> list[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT entry FROM session_entries "
+                "WHERE session_id = ? ORDER BY seq",
+                (session_id,),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    async def load(self, session_id: str) -> list[HistoryEntry]:
+        rows = await asyncio.to_thread(self._read, session_id)
+        self._saved[session_id] = len(rows)
+        return [decode_entry(row) for row in rows]
+
+    async def save(self, session_id: str, history: list[HistoryEntry]) -> None:
+        start = self._saved.get(session_id, 0)
+        if start >= len(history):
+            return
+        entries = [encode_entry(entry) for entry in history[start:]]
+        future: asyncio.Future[None] = (
+            asyncio.get_running_loop().create_future()
+        )
+        self._queue.put((session_id, start, entries, future))
+        await future
+        self._saved[session_id] = len(history)
+
+    def _delete(self, session_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM session_entries WHERE session_id = ?",
+                (session_id,),
+            )
+
+    async def delete(self, session_id: str) -> None:
+        # The saves of the session have been awaited by its turns already
+        self._saved.pop(session_id, None)
+        await asyncio.to_thread(self._delete, session_id)
+
+    def _write_loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            try:
+                # Collect the saves of other sessions arriving meanwhile
+                while True:
+                    next_item = self._queue.get(timeout=self.batch_window)
+                    if next_item is None:
+                        self._queue.put(None)
+                        break
+                    batch.append(next_item)
+            except queue.Empty:
+                pass
+            self._write_batch(batch)
+
+    def _write_batch(
+        self, batch: list[tuple[str, int, list[str], asyncio.Future[None]]]
+    ) -> None:
+        error: Exception | None = None
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO session_entries "
+                    "(session_id, seq, entry) VALUES (?, ?, ?)",
+                    [
+                        (session_id, start + offset, entry)
+                        for session_id, start, entries, _ in batch
+                        for offset, entry in enumerate(entries)
+                    ],
+                )
+                self._conn.execute("COMMIT")
+            except Exception as e:
+                logger.error(f"SQLiteSessionStore: write error: {e}")
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                error = e
+        for *_, future in batch:
+            future.get_loop().call_soon_threadsafe(_resolve, future, error)
+
+    async def aclose(self) -> None:
+        self._queue.put(None)
+        await asyncio.to_thread(self._writer.join)
+        self._conn.close()
+
+
+def _resolve(future: asyncio.Future[None], error: Exception | None) -> None:
+    if future.done():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
+
+
+_store: SessionStore | None = None
+
+
+def get_session_store() -> SessionStore:
+    """
+    Return the process-wide session store selected in `session_settings`
+    """
+    global _store
+    if _store is None:
+        session_settings = get_session_settings()
+        if session_settings["backend"] == "sqlite":
+            _store = SQLiteSessionStore(
+                Path(session_settings["path"]),
+                session_settings["batch_window"],
+            )
+        else:
+            _store = InProcessSessionStore(session_settings["max_sessions"])
+    return _store
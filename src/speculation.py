@@ -0,0 +1,128 @@
+import asyncio
+import json
+import logging
+import re
+from typing import Any
+
+from src.tools import BaseTool
+from src.tools.cache import normalize_arguments
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_ACTION_PATTERN = re.compile(r"^\s*Action\s*\(?\d+\)?\s*:\s*(.+)$")
+_QUOTED_PATTERN = re.compile(r"[\"'「『“]([^\"'」』”]+)[\"'」』”]")
+
+# Process-wide counters, hit rate = hits / started
+speculation_stats = {"started": 0, "hits": 0, "discarded": 0}
+
+
+def parse_action(
+    line: str, tools: dict[str, BaseTool]
+) -> tuple[str, dict[str, Any]] | None:
+    """
+    Guess the tool call planned by an "Action(N): ..." line of the reasoning.
+    Only tools with a single argument are recognized, the value is taken
+    from a JSON object, a quoted string, `arg=value` or the rest of the line.
+    """
+    match = _ACTION_PATTERN.match(line)
+    if not match:
+        return None
+    action = match.group(1)
+    for name, tool in tools.items():
+        index = action.find(name)
+        args = list(tool.parameters["properties"])
+        if index < 0 or len(args) != 1:
+            continue
+        rest = action[index + len(name) :]
+        value = None
+        if "{" in rest:
+            try:
+                start, end = rest.index("{"), rest.rindex("}") + 1
+                value = json.loads(rest[start:end]).get(args[0])
+            except (ValueError, AttributeError):
+                value = None
+        if value is None and (quoted := _QUOTED_PATTERN.search(rest)):
+            value = quoted.group(1)
+        if value is None and (
+            assigned := re.search(rf"{args[0]}\s*[=:]\s*(.+)", rest)
+        ):
+            value = assigned.group(1)
+        if value is None:
+            value = rest
+        value = str(value).strip(" \t:=-()（）。.,")
+        if value:
+            return name, {args[0]: value}
+    return None
+
+
+class SpeculativePrefetcher:
+    """
+    Starts the tool calls planned in a streamed reasoning before the answer
+    completion requests them. A call requested with the same tool and
+    arguments takes over the started one, the others are discarded.
+    """
+
+    def __init__(self, tools: dict[str, BaseTool]):
+        self.tools = {
+            name: tool for name, tool in tools.items() if tool.prefetchable
+        }
+        self._line = ""
+        self._tasks: dict[str, asyncio.Task[str]] = {}
+
+    @staticmethod
+    def _key(name: str, arguments: dict[str, Any]) -> str:
+        return json.dumps(
+            [name, normalize_arguments(arguments)],
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+
+    def feed(self, token: str) -> None:
+        """
+        Consume reasoning tokens, starting a call for each complete action
+        """
+        self._line += token
+        *lines, self._line = self._line.split("\n")
+        for line in lines:
+            self._start(line)
+
+    def finish(self) -> None:
+        line, self._line = self._line, ""
+        self._start(line)
+
+    def _start(self, line: str) -> None:
+        action = parse_action(line, self.tools)
+        if action is None:
+            return
+        name, arguments = action
+        key = self._key(name, arguments)
+        if key in self._tasks:
+            return
+        logger.info(f"Speculative prefetch: {name=}, {arguments=}")
+        self._tasks[key] = asyncio.ensure_future(
+            self.tools[name].invoke(**arguments)
+        )
+        speculation_stats["started"] += 1
+
+    def take(
+        self, name: str, arguments: dict[str, Any]
+    ) -> asyncio.Task[str] | None:
+        """
+        Return the started call matching a requested one, if any
+        """
+        task = self._tasks.pop(self._key(name, arguments), None)
+        if task is not None:
+            speculation_stats["hits"] += 1
+        return task
+
+    def discard(self) -> None:
+        """
+        Cancel the started calls that were not requested
+        """
+        for task in self._tasks.values():
+            task.cancel()
+            # Retrieve the outcome so failures are not reported as unhandled
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        speculation_stats["discarded"] += len(self._tasks)
+        self._tasks.clear()
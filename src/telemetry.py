@@ -0,0 +1,281 @@
+import atexit
+import json
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+from src.config import get_telemetry_settings
+from src.core.openai_module import usage_stats
+from src.core.rate_limit import get_rate_limit_stats
+from src.core.resilience import cancellation_stats, resilience_stats
+from src.core.streaming import streaming_stats
+from src.speculation import speculation_stats
+from src.tools.cache import get_cache_stats
+
+_settings = get_telemetry_settings()
+_enabled: bool = _settings["enabled"]
+_lock = threading.Lock()
+# (span name, labels) -> aggregated values, for the /metrics endpoint
+_Labels = tuple[tuple[str, str], ...]
+_aggregates: dict[tuple[str, _Labels], dict[str, float]] = {}
+# JSON lines of the spans not yet written by the file exporter
+_pending_lines: list[str] = []
+_writer: threading.Thread | None = None
+_file_lock = threading.Lock()
+if _enabled and _settings["exporter"] == "file":
+    Path(_settings["path"]).parent.mkdir(parents=True, exist_ok=True)
+
+
+class Span:
+    """
+    Timing and token usage of one unit of work (reasoning, answer, tool...)
+    """
+
+    __slots__ = (
+        "name",
+        "attributes",
+        "started_at",
+        "start_time",
+        "first_token_at",
+        "duration",
+        "prompt_tokens",
+        "completion_tokens",
+    )
+
+    def __init__(self, name: str, attributes: dict[str, Any]) -> None:
+        self.name = name
+        self.attributes = attributes
+        self.started_at = time.perf_counter()
+        self.start_time = time.time_ns()
+        self.first_token_at: float | None = None
+        self.duration = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def first_token(self) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def usage(self, usage: Any) -> None:
+        self.prompt_tokens += usage.prompt_tokens
+        self.completion_tokens += usage.completion_tokens
+
+    @property
+    def ttft(self) -> float | None:
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started_at
+
+
+class NoopSpan:
+    """
+    Returned while telemetry is disabled, so that instrumented code costs a
+    flag check and a few no-op calls
+    """
+
+    def first_token(self) -> None:
+        pass
+
+    def usage(self, usage: Any) -> None:
+        pass
+
+
+_NOOP_SPAN = NoopSpan()
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span | NoopSpan]:
+    """
+    Record the duration of the block as a span named `name`
+    """
+    if not _enabled:
+        yield _NOOP_SPAN
+        return
+    current = Span(name, attributes)
+    try:
+        yield current
+    finally:
+        current.duration = time.perf_counter() - current.started_at
+        _export(current)
+
+
+def _export(current: Span) -> None:
+    if _settings["exporter"] == "file":
+        _write_span(current)
+        return
+    labels = tuple(sorted((k, str(v)) for k, v in current.attributes.items()))
+    with _lock:
+        aggregate = _aggregates.setdefault(
+            (current.name, labels),
+            {
+                "count": 0,
+                "duration_sum": 0.0,
+                "ttft_count": 0,
+                "ttft_sum": 0.0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+            },
+        )
+        aggregate["count"] += 1
+        aggregate["duration_sum"] += current.duration
+        if current.ttft is not None:
+            aggregate["ttft_count"] += 1
+            aggregate["ttft_sum"] += current.ttft
+        aggregate["prompt_tokens"] += current.prompt_tokens
+        aggregate["completion_tokens"] += current.completion_tokens
+
+
+def _write_span(current: Span) -> None:
+    """
+    Buffer the span as a JSON line shaped like an OTLP span, to be appended
+    to the file by a background thread
+    """
+    global _writer
+    attributes = {
+        **current.attributes,
+        "ttft": current.ttft,
+        "prompt_tokens": current.prompt_tokens,
+        "completion_tokens": current.completion_tokens,
+    }
+    record = {
+        "name": current.name,
+        "startTimeUnixNano": current.start_time,
+        "endTimeUnixNano": current.start_time + int(current.duration * 1e9),
+        "attributes": [
+            {"key": key, "value": value}
+            for key, value in attributes.items()
+            if value is not None
+        ],
+    }
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    with _lock:
+        _pending_lines.append(line)
+        if _writer is None:
+            _writer = threading.Thread(target=_write_periodically, daemon=True)
+            _writer.start()
+            atexit.register(_flush_spans)
+
+
+def _write_periodically() -> None:
+    while True:
+        time.sleep(_settings["flush_interval"])
+        _flush_spans()
+
+
+def _flush_spans() -> None:
+    """
+    Append the buffered spans to the file
+    """
+    with _file_lock:
+        with _lock:
+            lines = _pending_lines.copy()
+            _pending_lines.clear()
+        if lines:
+            with open(_settings["path"], "a") as f:
+                f.writelines(lines)
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    escaped = ",".join(
+        f'{key}="{str(value).replace(chr(34), chr(39))}"'
+        for key, value in labels.items()
+    )
+    return "{" + escaped + "}"
+
+
+def render_metrics() -> str:
+    """
+    Render the metrics in the Prometheus text exposition format
+    """
+    lines = []
+    with _lock:
+        aggregates = {key: dict(value) for key, value in _aggregates.items()}
+    for metric, (sum_key, count_key) in {
+        "span_duration_seconds": ("duration_sum", "count"),
+        "span_ttft_seconds": ("ttft_sum", "ttft_count"),
+    }.items():
+        lines.append(f"# TYPE reasoning_chat_{metric} summary")
+        for (name, labels), aggregate in aggregates.items():
+            label_str = _format_labels({"span": name, **dict(labels)})
+            lines.append(
+                f"reasoning_chat_{metric}_sum{label_str} {aggregate[sum_key]}"
+            )
+            lines.append(
+                f"reasoning_chat_{metric}_count{label_str} "
+                f"{aggregate[count_key]}"
+            )
+
+    lines.append("# TYPE reasoning_chat_span_tokens_total counter")
+    for (name, labels), aggregate in aggregates.items():
+        for kind in ("prompt_tokens", "completion_tokens"):
+            label_str = _format_labels(
+                {"span": name, **dict(labels), "kind": kind}
+            )
+            lines.append(
+                f"reasoning_chat_span_tokens_total{label_str} "
+                f"{aggregate[kind]}"
+            )
+
+    lines.append("# TYPE reasoning_chat_openai_tokens_total counter")
+    for kind, value in usage_stats.items():
+        label_str = _format_labels({"kind": kind})
+        lines.append(f"reasoning_chat_openai_tokens_total{label_str} {value}")
+
+    lines.append("# TYPE reasoning_chat_completion_resilience_total counter")
+    for event, value in resilience_stats.items():
+        label_str = _format_labels({"event": event})
+        lines.append(
+            f"reasoning_chat_completion_resilience_total{label_str} {value}"
+        )
+
+    lines.append("# TYPE reasoning_chat_cancelled_total counter")
+    for kind, value in cancellation_stats.items():
+        label_str = _format_labels({"kind": kind})
+        lines.append(f"reasoning_chat_cancelled_total{label_str} {value}")
+
+    lines.append("# TYPE reasoning_chat_rate_limit_total counter")
+    for limiter, limiter_stats in get_rate_limit_stats().items():
+        for key, amount in limiter_stats.items():
+            label_str = _format_labels({"limiter": limiter, "kind": key})
+            lines.append(
+                f"reasoning_chat_rate_limit_total{label_str} {amount}"
+            )
+
+    lines.append("# TYPE reasoning_chat_tool_cache_total counter")
+    for tool, stats in get_cache_stats().items():
+        for result, value in stats.items():
+            label_str = _format_labels({"tool": tool, "result": result})
+            lines.append(f"reasoning_chat_tool_cache_total{label_str} {value}")
+
+    lines.append("# TYPE reasoning_chat_speculative_prefetch_total counter")
+    for result, value in speculation_stats.items():
+        label_str = _format_labels({"result": result})
+        lines.append(
+            f"reasoning_chat_speculative_prefetch_total{label_str} {value}"
+        )
+
+    lines.append("# TYPE reasoning_chat_stream_total counter")
+    for kind, value in streaming_stats.items():
+        label_str = _format_labels({"kind": kind})
+        lines.append(f"reasoning_chat_stream_total{label_str} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def mount_metrics(app: Any) -> None:
+    """
+    Serve `render_metrics` on /metrics of a Starlette/FastAPI app.
+    The route is put first so that catch-all routes of the app don't
+    shadow it.
+    """
+    from starlette.responses import PlainTextResponse
+    from starlette.routing import Route
+
+    async def metrics(_request: Any) -> PlainTextResponse:
+        return PlainTextResponse(
+            render_metrics(), media_type="text/plain; version=0.0.4"
+        )
+
+    app.router.routes.insert(0, Route("/metrics", metrics, methods=["GET"]))
@@ -1,4 +1,38 @@
+import importlib
+from typing import TYPE_CHECKING, Any
+
 from .base_tool import BaseTool
-from .dify_googlesearch import GoogleSearchTool
-from .dify_telephone import GetRepresentativeTelephoneTool
-from .memory_updater import MemoryUpdaterTool
+
+# Tool implementations are imported on first access, so that importing the
+# package (e.g. for BaseTool) doesn't pull in their HTTP dependencies
+_LAZY_ATTRIBUTES = {
+    "AttachmentSearchTool": ".attachment_search",
+    "DifyWorkflowTool": ".dify_base",
+    "GoogleSearchTool": ".dify_googlesearch",
+    "GetRepresentativeTelephoneTool": ".dify_telephone",
+    "MemoryUpdaterTool": ".memory_updater",
+}
+
+if TYPE_CHECKING:
+    from .attachment_search import AttachmentSearchTool
+    from .dify_base import DifyWorkflowTool
+    from .dify_googlesearch import GoogleSearchTool
+    from .dify_telephone import GetRepresentativeTelephoneTool
+    from .memory_updater import MemoryUpdaterTool
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = importlib.import_module(_LAZY_ATTRIBUTES[name], __name__)
+    return getattr(module, name)
+
+
+__all__ = [
+    "AttachmentSearchTool",
+    "BaseTool",
+    "DifyWorkflowTool",
+    "GoogleSearchTool",
+    "GetRepresentativeTelephoneTool",
+    "MemoryUpdaterTool",
+]
@@ -0,0 +1,55 @@
+from typing import Any
+
+from src.attachments import current_attachment_index
+from src.config import get_attachment_settings, get_settings
+from src.core.tokens import count_tokens
+from src.tools import BaseTool
+
+
+class AttachmentSearchTool(BaseTool):
+    def __init__(self) -> None:
+        self.name = "search_attachments"
+        self.description = "A function to search the files attached by the user in this chat. Returns the passages of the files relevant to the query."
+        self.parameters: dict[str, Any] = {
+            "type": "object",
+            "properties": {
+                "query": {
+                    "type": "string",
+                    "description": "Search query. Enter keywords separated by spaces.",
+                }
+            },
+            "required": ["query"],
+        }
+        self.definition = {
+            "type": "function",
+            "function": {
+                "name": self.name,
+                "description": self.description,
+                "parameters": self.parameters,
+            },
+        }
+
+    def run(self, **kwargs) -> str:
+        query = kwargs.get("query")
+        if not query:
+            raise ValueError("query is required")
+
+        index = current_attachment_index()
+        if index is None or not len(index):
+            return "No files are attached in this chat."
+        settings = get_attachment_settings()
+        model = get_settings()["model"]
+        passages = []
+        total_tokens = 0
+        for source, text in index.search(query, settings["top_k"]):
+            passage = f"[{source}]\n{text}"
+            if passage in passages:  # the same file attached twice
+                continue
+            tokens = count_tokens(passage, model)
+            if total_tokens + tokens > settings["max_tokens"]:
+                continue
+            passages.append(passage)
+            total_tokens += tokens
+        if not passages:
+            return "No passages of the attached files match the query."
+        return "\n\n".join(passages)
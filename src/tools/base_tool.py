@@ -1,14 +1,114 @@
+import asyncio
+import contextvars
+import functools
 from abc import ABC, abstractmethod
-from typing import Any
+from collections.abc import Awaitable, Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Any
+
+from src.config import get_tool_settings
+from src.tools.cache import get_tool_cache
+
+if TYPE_CHECKING:
+    from src.memory import ExperimentalMemory
+
+_executor: ThreadPoolExecutor | None = None
+
+_progress: ContextVar[Callable[[str], Awaitable[None]] | None] = ContextVar(
+    "tool_progress", default=None
+)
+
+
+def get_tool_executor() -> ThreadPoolExecutor:
+    """
+    Return the process-wide thread pool used to run sync-only tools.
+    The pool is created on first use and bounded by `max_workers`.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=get_tool_settings()["max_workers"],
+            thread_name_prefix="tool",
+        )
+    return _executor
+
+
+@contextmanager
+def tool_progress(
+    callback: Callable[[str], Awaitable[None]],
+) -> Iterator[None]:
+    """
+    Send the partial output of the tools run in the block to `callback`,
+    e.g. the UI step showing the call
+    """
+    token = _progress.set(callback)
+    try:
+        yield
+    finally:
+        _progress.reset(token)
+
+
+async def report_progress(text: str) -> None:
+    """
+    Show partial output of the running tool call, if the UI shows it
+    """
+    callback = _progress.get()
+    if callback is not None:
+        await callback(text)
 
 
 class BaseTool(ABC):
+    # Read-only tools may be started speculatively before the model asks
+    prefetchable: bool = False
+
     def __init__(self) -> None:
         self.name: str = ""
         self.description: str = ""
         self.parameters: dict[str, Any] = {}
         self.definition: dict[str, Any] = {}
 
+    @classmethod
+    def create(cls, memory: "ExperimentalMemory") -> "BaseTool":
+        """
+        Create the tool for the registry.
+        Tools that depend on the memory override this method.
+        """
+        return cls()
+
     @abstractmethod
     def run(self) -> str:
         pass
+
+    async def arun(self, **kwargs) -> str:
+        """
+        Run the tool without blocking the event loop.
+        Tools with a native async implementation override this method,
+        otherwise `run` is executed on the shared tool thread pool, in a
+        copy of the context of the turn (e.g. its session).
+        """
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            get_tool_executor(),
+            functools.partial(context.run, self.run, **kwargs),
+        )
+
+    def is_cacheable(self, result: str) -> bool:
+        """
+        Whether a result may be stored in the result cache
+        """
+        return True
+
+    async def invoke(self, **kwargs) -> str:
+        """
+        Entry point used by the agent.
+        Calls `arun` through the result cache when it is enabled for the tool.
+        """
+        cache = get_tool_cache(self.name)
+        if cache is None:
+            return await self.arun(**kwargs)
+        return await cache.get_or_call(
+            kwargs, lambda: self.arun(**kwargs), self.is_cacheable
+        )
@@ -0,0 +1,252 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from typing import Any
+
+from src.config import get_tool_settings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend(ABC):
+    @abstractmethod
+    async def get(self, key: str) -> str | None:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        pass
+
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    In-process LRU cache with per-entry expiry, for single-worker deployments
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+    async def get(self, key: str) -> str | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        self._entries[key] = (time.time() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class DiskCacheBackend(CacheBackend):
+    """
+    SQLite-backed LRU cache with per-entry expiry.
+    The file can be shared by several workers on the same host, so queries
+    may wait for the lock of another worker; they run in a thread, off the
+    event loop.
+    """
+
+    def __init__(self, path: Path, max_entries: int):
+        self.max_entries = max_entries
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, timeout=5.0, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tool_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+
+    async def get(self, key: str) -> str | None:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+    def _get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM tool_cache WHERE key = ? AND expires_at > ?",
+                (key, now),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE tool_cache SET accessed_at = ? WHERE key = ?",
+                (now, key),
+            )
+        return row[0]
+
+    def _set(self, key: str, value: str, ttl: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tool_cache VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now),
+            )
+            self._conn.execute(
+                "DELETE FROM tool_cache WHERE expires_at <= ?", (now,)
+            )
+            self._conn.execute(
+                "DELETE FROM tool_cache WHERE key IN ("
+                "SELECT key FROM tool_cache ORDER BY accessed_at DESC "
+                "LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    return value
+
+
+def normalize_arguments(arguments: dict[str, Any]) -> dict[str, Any]:
+    """
+    Normalize tool arguments so that equivalent calls compare equal
+    """
+    return {k: _normalize(v) for k, v in arguments.items() if v is not None}
+
+
+class ToolResultCache:
+    """
+    Result cache of one tool, keyed on its normalized arguments.
+    Concurrent calls with the same arguments share a single in-flight call.
+    """
+
+    def __init__(self, tool_name: str, backend: CacheBackend, ttl: float):
+        self.tool_name = tool_name
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._inflight: dict[str, asyncio.Task[str]] = {}
+        # Callers waiting for each in-flight call
+        self._waiters: dict[str, int] = {}
+        # Results being written to the backend
+        self._writes: set[asyncio.Task[None]] = set()
+
+    def make_key(self, arguments: dict[str, Any]) -> str:
+        normalized = normalize_arguments(arguments)
+        digest = hashlib.sha256(
+            json.dumps(normalized, sort_keys=True, ensure_ascii=False).encode()
+        ).hexdigest()
+        return f"{self.tool_name}:{digest}"
+
+    async def get_or_call(
+        self,
+        arguments: dict[str, Any],
+        call: Callable[[], Awaitable[str]],
+        is_cacheable: Callable[[str], bool],
+    ) -> str:
+        key = self.make_key(arguments)
+        value = await self.backend.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(call())
+            self._inflight[key] = task
+
+            def _on_done(done: asyncio.Task[str]) -> None:
+                self._inflight.pop(key, None)
+                if done.cancelled() or done.exception() is not None:
+                    return
+                if is_cacheable(done.result()):
+                    # The callers get the result without waiting for it to
+                    # be written
+                    write = asyncio.ensure_future(
+                        self._write(key, done.result())
+                    )
+                    self._writes.add(write)
+                    write.add_done_callback(self._writes.discard)
+
+            task.add_done_callback(_on_done)
+        # A cancelled caller must not cancel the call other callers wait on,
+        # the call is only cancelled when its last caller is
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[key] == 1:
+                task.cancel()
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    async def _write(self, key: str, value: str) -> None:
+        try:
+            await self.backend.set(key, value, self.ttl)
+        except Exception as e:
+            logger.warning(f"{self.tool_name}: result not cached: {e}")
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+
+_backend: CacheBackend | None = None
+_caches: dict[str, ToolResultCache] = {}
+
+
+def get_tool_cache(tool_name: str) -> ToolResultCache | None:
+    """
+    Return the result cache of the tool, or None if caching is not enabled
+    for it in `tool_settings.cache_ttl`
+    """
+    global _backend
+    if tool_name in _caches:
+        return _caches[tool_name]
+
+    tool_settings = get_tool_settings()
+    ttl = tool_settings["cache_ttl"].get(tool_name)
+    if not ttl:
+        return None
+    if _backend is None:
+        if tool_settings["cache_backend"] == "disk":
+            _backend = DiskCacheBackend(
+                Path(tool_settings["cache_path"]),
+                tool_settings["cache_max_entries"],
+            )
+        else:
+            _backend = MemoryCacheBackend(tool_settings["cache_max_entries"])
+    _caches[tool_name] = ToolResultCache(tool_name, _backend, ttl)
+    return _caches[tool_name]
+
+
+def get_cache_stats() -> dict[str, dict[str, int]]:
+    """
+    Return hit/miss counters of every tool cache created so far
+    """
+    return {name: cache.stats() for name, cache in _caches.items()}
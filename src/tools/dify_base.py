@@ -0,0 +1,231 @@
+import asyncio
+import json
+import logging
+from abc import abstractmethod
+from collections.abc import AsyncIterator
+from typing import TYPE_CHECKING, Any
+
+from src.config import get_tool_settings
+from src.core import http_pool, rate_limit
+from src.tools import BaseTool
+from src.tools.base_tool import report_progress
+
+if TYPE_CHECKING:
+    import httpx
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Stop requests in flight, referenced until they are done
+_stop_tasks: set[asyncio.Task[None]] = set()
+
+
+class DifyWorkflowTool(BaseTool):
+    """
+    Base class for tools backed by a Dify workflow (`/workflows/run`).
+    Subclasses build the workflow inputs and pick the result from its outputs,
+    the request itself goes through the shared connection pool.
+
+    `arun` uses the response mode of `tool_settings`; `run` always blocks.
+    """
+
+    prefetchable = True
+    api_endpoint: str = ""
+    api_key: str = ""
+    # Returned instead of raising when the request could not be sent
+    error_message: str = "Failed to execute the workflow"
+
+    @abstractmethod
+    def build_inputs(self, **kwargs) -> dict[str, Any]:
+        pass
+
+    @abstractmethod
+    def parse_outputs(self, outputs: dict[str, Any]) -> str:
+        pass
+
+    def _headers(self) -> dict[str, str]:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+
+    def _request_args(
+        self, inputs: dict[str, Any], response_mode: str = "blocking"
+    ) -> dict[str, Any]:
+        return {
+            "url": f"{self.api_endpoint}/workflows/run",
+            "headers": self._headers(),
+            "json": {
+                "inputs": inputs,
+                "response_mode": response_mode,
+                "user": "abc",
+            },
+        }
+
+    def run(self, **kwargs) -> str:
+        inputs = self.build_inputs(**kwargs)
+        try:
+            response = http_pool.get_session().post(
+                **self._request_args(inputs),
+                timeout=http_pool.get_timeout(),
+            )
+        except Exception as e:
+            logger.error(f"{type(self).__name__}: request post error: {e}")
+            return self.error_message
+
+        response.raise_for_status()
+        result = self.parse_outputs(response.json()["data"]["outputs"])
+        logger.debug(f"{type(self).__name__}: get {result=}")
+        return result
+
+    def is_cacheable(self, result: str) -> bool:
+        return result != self.error_message
+
+    async def arun(self, **kwargs) -> str:
+        inputs = self.build_inputs(**kwargs)
+        response_mode = get_tool_settings()["dify_response_mode"]
+        request_args = self._request_args(inputs, response_mode)
+        limiter = rate_limit.get_endpoint_limiter(self.api_endpoint)
+        if limiter:
+            await limiter.acquire()
+        try:
+            async with http_pool.host_slot(request_args["url"]):
+                if response_mode == "streaming":
+                    return await self._arun_streaming(request_args)
+                response = await http_pool.get_async_client().post(
+                    **request_args
+                )
+        except Exception as e:
+            logger.error(f"{type(self).__name__}: request post error: {e}")
+            return self.error_message
+
+        response.raise_for_status()
+        result = self.parse_outputs(response.json()["data"]["outputs"])
+        logger.debug(f"{type(self).__name__}: get {result=}")
+        return result
+
+    async def _arun_streaming(self, request_args: dict[str, Any]) -> str:
+        """
+        Run the workflow in streaming mode, reporting the nodes as they
+        start and the text they stream as partial output.
+        A workflow that runs past `dify_workflow_timeout`, or with a node
+        running past `dify_node_timeout`, is abandoned and stopped.
+        """
+        tool_settings = get_tool_settings()
+        loop = asyncio.get_running_loop()
+        workflow_deadline = (
+            loop.time() + tool_settings["dify_workflow_timeout"]
+        )
+        # node id -> (title, deadline) of the running nodes
+        running: dict[str, tuple[str, float]] = {}
+        task_id = ""
+        try:
+            async with asyncio.timeout_at(workflow_deadline) as deadline:
+                async with http_pool.get_async_client().stream(
+                    "POST", **request_args
+                ) as response:
+                    response.raise_for_status()
+                    async for event in _sse_events(response):
+                        task_id = event.get("task_id") or task_id
+                        result = await self._on_event(
+                            event, running, tool_settings["dify_node_timeout"]
+                        )
+                        if result is not None:
+                            return result
+                        deadline.reschedule(
+                            min(
+                                [workflow_deadline]
+                                + [at for _, at in running.values()]
+                            )
+                        )
+        except TimeoutError:
+            stuck = [title for title, _ in running.values()]
+            logger.warning(
+                f"{type(self).__name__}: workflow timed out, {stuck=}"
+            )
+            self._stop(task_id)
+            return self.error_message
+        except asyncio.CancelledError:
+            self._stop(task_id)
+            raise
+        logger.error(f"{type(self).__name__}: stream ended before the result")
+        return self.error_message
+
+    async def _on_event(
+        self,
+        event: dict[str, Any],
+        running: dict[str, tuple[str, float]],
+        node_timeout: float,
+    ) -> str | None:
+        """
+        Handle one streaming event, returns the result once the workflow
+        has finished
+        """
+        kind = event.get("event")
+        data = event.get("data") or {}
+        if kind == "node_started":
+            title = data.get("title") or data.get("node_type", "")
+            deadline = asyncio.get_running_loop().time() + node_timeout
+            running[data["node_id"]] = (title, deadline)
+            await report_progress(f"{title}...\n")
+        elif kind == "node_finished":
+            running.pop(data["node_id"], None)
+        elif kind == "text_chunk":
+            await report_progress(data.get("text", ""))
+        elif kind == "workflow_finished":
+            if data.get("status") != "succeeded":
+                logger.error(
+                    f"{type(self).__name__}: workflow {data.get('status')}: "
+                    f"{data.get('error')}"
+                )
+                return self.error_message
+            result = self.parse_outputs(data["outputs"])
+            logger.debug(f"{type(self).__name__}: get {result=}")
+            return result
+        elif kind == "error":
+            logger.error(
+                f"{type(self).__name__}: workflow error: "
+                f"{event.get('message')}"
+            )
+            return self.error_message
+        return None
+
+    def _stop(self, task_id: str) -> None:
+        """
+        Ask Dify to stop an abandoned workflow run, in the background so that
+        the turn doesn't wait for an unreachable Dify
+        """
+        if not task_id:
+            return
+        task = asyncio.ensure_future(self._send_stop(task_id))
+        _stop_tasks.add(task)
+        task.add_done_callback(_stop_tasks.discard)
+
+    async def _send_stop(self, task_id: str) -> None:
+        try:
+            await http_pool.get_async_client().post(
+                f"{self.api_endpoint}/workflows/tasks/{task_id}/stop",
+                headers=self._headers(),
+                json={"user": "abc"},
+                timeout=get_tool_settings()["dify_stop_timeout"],
+            )
+        except Exception as e:
+            logger.warning(f"{type(self).__name__}: stop error: {e}")
+
+
+async def _sse_events(
+    response: "httpx.Response",
+) -> AsyncIterator[dict[str, Any]]:
+    """
+    Parse the server-sent events of a response as they arrive.
+    Events without data, e.g. Dify's pings, are skipped.
+    """
+    data: list[str] = []
+    async for line in response.aiter_lines():
+        if line.startswith("data:"):
+            data.append(line[5:].removeprefix(" "))
+        elif not line and data:
+            yield json.loads("\n".join(data))
+            data = []
+    if data:
+        yield json.loads("\n".join(data))
@@ -1,16 +1,12 @@
-import logging
 import os
 from typing import Any
 
-import requests
+from src.tools import DifyWorkflowTool
 
-from src.tools import BaseTool
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+class GoogleSearchTool(DifyWorkflowTool):
+    error_message = "Failed to retrieve results"
 
-
-class GoogleSearchTool(BaseTool):
     def __init__(self) -> None:
         self.api_endpoint = os.getenv("DIFY_GOOGLESEARCH_API_ENDPOINT", "")
         self.api_key = os.getenv("DIFY_GOOGLESEARCH_API_KEY", "")
@@ -35,37 +31,14 @@ class GoogleSearchTool(BaseTool):
             },
         }
 
-    def run(self, **kwargs) -> str:
+    def build_inputs(self, **kwargs) -> dict[str, Any]:
         query = kwargs.get("query")
         if not query:
             raise ValueError("query is required")
+        return {"query": query}
 
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
-        payload = {
-            "inputs": {
-                "query": query,
-            },
-            "response_mode": "blocking",
-            "user": "abc",
-        }
-        try:
-            response = requests.post(
-                f"{self.api_endpoint}/workflows/run",
-                headers=headers,
-                json=payload,
-                timeout=(10.0, 30.0),
-            )
-        except Exception as e:
-            logger.error(f"GoogleSearchTool: request post error: {e}")
-            return "Failed to retrieve results"
-
-        response.raise_for_status()
-        result = response.json()["data"]["outputs"]["result"]
-        logger.info(f"GoogleSearchTool: get {result=}")
-        return result
+    def parse_outputs(self, outputs: dict[str, Any]) -> str:
+        return outputs["result"]
 
 
 if __name__ == "__main__":
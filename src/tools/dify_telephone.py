@@ -1,16 +1,12 @@
-import logging
 import os
 from typing import Any
 
-import requests
+from src.tools import DifyWorkflowTool
 
-from src.tools import BaseTool
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+class GetRepresentativeTelephoneTool(DifyWorkflowTool):
+    error_message = "Failed to get telephone number"
 
-
-class GetRepresentativeTelephoneTool(BaseTool):
     def __init__(self) -> None:
         self.api_endpoint = os.getenv("DIFY_TELEPHONE_API_ENDPOINT", "")
         self.api_key = os.getenv("DIFY_TELEPHONE_API_KEY", "")
@@ -35,40 +31,14 @@ class GetRepresentativeTelephoneTool(BaseTool):
             },
         }
 
-    def run(self, **kwargs) -> str:
+    def build_inputs(self, **kwargs) -> dict[str, Any]:
         company = kwargs.get("company")
         if not company:
             raise ValueError("company is required")
+        return {"input": company}
 
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
-
-        data: dict[str, Any] = {
-            "inputs": {"input": company},
-            "response_mode": "blocking",
-            "user": "abc",
-        }
-
-        logger.info(f"GetRepresentativeTelephoneTool: request post")
-        try:
-            response = requests.post(
-                f"{self.api_endpoint}/workflows/run",
-                headers=headers,
-                json=data,
-                timeout=(10.0, 30.0),
-            )
-        except Exception as e:
-            logger.error(f"GetRepresentativeTelephoneTool: error {e}")
-            return "Failed to get telephone number"
-        logger.info(f"GetRepresentativeTelephoneTool: get {response=}")
-
-        response.raise_for_status()
-        body = response.json()
-        telephone = body["data"]["outputs"]["output"]
-
-        return telephone
+    def parse_outputs(self, outputs: dict[str, Any]) -> str:
+        return outputs["output"]
 
 
 if __name__ == "__main__":
@@ -36,6 +36,10 @@ class MemoryUpdaterTool(BaseTool):
         }
         self.memory = memory
 
+    @classmethod
+    def create(cls, memory: ExperimentalMemory) -> "MemoryUpdaterTool":
+        return cls(memory)
+
     def run(self, **kwargs) -> str:
         memory_sentences = kwargs.get("memory_sentences")
         if not memory_sentences:
@@ -0,0 +1,55 @@
+import unittest
+
+from src.planning import PlanAnswerSplitter
+
+
+def split(chunks: list[str]) -> tuple[str, str, PlanAnswerSplitter]:
+    """
+    Feed the chunks like a stream, returns the emitted plan and answer
+    """
+    splitter = PlanAnswerSplitter()
+    plan = answer = ""
+    for chunk in chunks:
+        plan_part, answer_part = splitter.feed(chunk)
+        plan += plan_part
+        answer += answer_part
+    if not splitter.answer_started:
+        plan += splitter.flush()
+    return plan, answer, splitter
+
+
+class PlanAnswerSplitterTest(unittest.TestCase):
+    def test_plan_and_answer(self) -> None:
+        plan, answer, splitter = split(
+            ["Thought: gre", "et the user\nAns", "wer: Hello", "!"]
+        )
+        self.assertEqual(plan, "Thought: greet the user\n")
+        self.assertEqual(answer, "Hello!")
+        self.assertEqual(splitter.plan, plan)
+
+    def test_marker_inside_a_line_is_plan(self) -> None:
+        plan, answer, _ = split(["Thought: no Answer: here\nAnswer: ok"])
+        self.assertEqual(plan, "Thought: no Answer: here\n")
+        self.assertEqual(answer, "ok")
+
+    def test_answer_without_marker(self) -> None:
+        chunks = ["こんにちは！", "ご用件は", "何でも聞いてください。"]
+        plan, answer, splitter = split(chunks)
+        self.assertEqual(plan, "")
+        self.assertEqual(answer, "".join(chunks))
+        self.assertEqual(splitter.plan, "")
+
+    def test_plan_prefix_split_across_chunks(self) -> None:
+        plan, answer, _ = split(["Tho", "ught: x\n", "Answer: y"])
+        self.assertEqual(plan, "Thought: x\n")
+        self.assertEqual(answer, "y")
+
+    def test_plan_without_answer(self) -> None:
+        plan, answer, splitter = split(["Thought: x\nAction1: search"])
+        self.assertEqual(plan, "Thought: x\nAction1: search")
+        self.assertEqual(answer, "")
+        self.assertFalse(splitter.answer_started)
+
+
+if __name__ == "__main__":
+    unittest.main()
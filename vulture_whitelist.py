@@ -0,0 +1,14 @@
+# Names vulture can't see being used, checked by `make lint` along with the
+# code. Types imported under TYPE_CHECKING are only used in string
+# annotations.
+from openai import AsyncStream
+from openai.types.chat.chat_completion_chunk import (
+    ChatCompletionChunk,
+    ChoiceDeltaToolCall,
+)
+from openai.types.completion_usage import CompletionUsage
+
+AsyncStream
+ChatCompletionChunk
+ChoiceDeltaToolCall
+CompletionUsage